@@ -0,0 +1,74 @@
+"""Random augmentation of collated graph batches.
+
+BatchAugment works on the tensors of a PyG Batch (x, edge_index, batch) in
+a handful of vectorized torch ops, so it runs between the DataLoader and
+GrapeGAT.forward at a cost independent of the number of graphs. Node
+features are the raw [x, y, width, type] columns.
+"""
+import copy
+import math
+
+import torch
+from torch_geometric.nn import global_mean_pool
+
+
+class BatchAugment:
+    """
+    Callable returning an augmented shallow copy of a Batch.
+    - Rotation by a uniform angle and a coin-flip mirror of x, both about
+      each graph's centroid
+    - Gaussian jitter of node coordinates (`jitter` pixels)
+    - Per-graph width scaling by a factor in [1 - width_scale, 1 + width_scale],
+      applied to node widths and to the `edge_width_cols` of edge_attr
+    - Dropout of vessel segments: both directions of an edge are dropped together
+    All randomness comes from one seeded torch.Generator.
+    """
+    def __init__(self, edge_drop=0.1, jitter=2.0, width_scale=0.1, rotate=True, flip=True,
+                 edge_width_cols=(2, 3), seed=0):
+        self.edge_drop, self.jitter, self.width_scale = edge_drop, jitter, width_scale
+        self.edge_width_cols = list(edge_width_cols)
+        self.rotate, self.flip = rotate, flip
+        self.generator = torch.Generator().manual_seed(seed)
+
+    def _uniform(self, *size):
+        return torch.rand(*size, generator=self.generator)
+
+    def __call__(self, batch):
+        out = copy.copy(batch)
+        x, node_graph = batch.x.clone(), batch.batch
+        num_graphs = batch.num_graphs
+        edge_attr = getattr(batch, 'edge_attr', None)
+
+        if self.rotate or self.flip:
+            center = global_mean_pool(x[:, :2], node_graph, num_graphs)[node_graph]
+            xy = x[:, :2] - center
+            if self.flip:
+                mirror = torch.where(self._uniform(num_graphs) < 0.5, -1.0, 1.0)
+                xy[:, 0] *= mirror[node_graph]
+            if self.rotate:
+                theta = (self._uniform(num_graphs) * 2 * math.pi)[node_graph]
+                cos, sin = torch.cos(theta), torch.sin(theta)
+                xy = torch.stack([cos * xy[:, 0] - sin * xy[:, 1], sin * xy[:, 0] + cos * xy[:, 1]], dim=1)
+            x[:, :2] = xy + center
+        if self.jitter:
+            x[:, :2] += torch.randn(len(x), 2, generator=self.generator) * self.jitter
+        if self.width_scale:
+            scale = 1 + (2 * self._uniform(num_graphs) - 1) * self.width_scale
+            x[:, 2] *= scale[node_graph]
+            if edge_attr is not None and self.edge_width_cols:
+                edge_attr = edge_attr.clone()
+                edge_attr[:, self.edge_width_cols] *= scale[node_graph[batch.edge_index[0]]].unsqueeze(1)
+        out.x = x
+        if edge_attr is not None:
+            out.edge_attr = edge_attr
+
+        if self.edge_drop:
+            # One draw per undirected segment so both directions share it
+            src, dst = batch.edge_index
+            pair = torch.minimum(src, dst) * len(x) + torch.maximum(src, dst)
+            segments, segment = torch.unique(pair, return_inverse=True)
+            keep = (self._uniform(len(segments)) >= self.edge_drop)[segment]
+            out.edge_index = batch.edge_index[:, keep]
+            if edge_attr is not None:
+                out.edge_attr = edge_attr[keep]
+        return out
@@ -1,9 +1,16 @@
 import torch
 import torch.nn.functional as F
 from torch_geometric.nn import GCNConv, GATConv, global_mean_pool, global_max_pool, global_add_pool
-from torch_geometric.data import Data, DataLoader
+from torch_geometric.data import Data, DataLoader, InMemoryDataset
+import hashlib
+import os
+import time
 import pandas as pd
 import numpy as np
+from pathlib import Path
+from descriptors import NUM_DESCRIPTORS, cached_descriptors
+from augment import BatchAugment
+import profiling
 
 class GrapeGAT(torch.nn.Module):
     """
@@ -12,14 +19,22 @@ class GrapeGAT(torch.nn.Module):
     - Multiple pooling strategies (mean + max + add)
     - Graph-level topological features
     """
-    def __init__(self, in_dim, hid=64, out=2, heads=4, dropout=0.3):
+    def __init__(self, in_dim, hid=64, out=2, heads=4, dropout=0.3, graph_dim=NUM_DESCRIPTORS, edge_dim=None):
         super().__init__()
         self.dropout = dropout
+        self.config = dict(in_dim=in_dim, hid=hid, out=out, heads=heads, dropout=dropout, graph_dim=graph_dim,
+                           edge_dim=edge_dim)
         
-        # GAT layers with multi-head attention
-        self.conv1 = GATConv(in_dim, hid, heads=heads, dropout=dropout)
-        self.conv2 = GATConv(hid * heads, hid, heads=heads, dropout=dropout)
-        self.conv3 = GATConv(hid * heads, hid, heads=1, dropout=dropout)
+        # Raw node features [x, y, width, type] and edge attributes [length,
+        # tortuosity, mean width, min width] are scaled inside the model so
+        # that datasets can be loaded as zero-copy views
+        self.register_buffer('node_scale', torch.tensor([1 / 600, 1 / 600, 1 / 20, 1.0]), persistent=False)
+        self.register_buffer('edge_scale', torch.tensor([1 / 50, 1.0, 1 / 20, 1 / 20]), persistent=False)
+        
+        # GAT layers with multi-head attention, attending over edge attributes if given
+        self.conv1 = GATConv(in_dim, hid, heads=heads, dropout=dropout, edge_dim=edge_dim)
+        self.conv2 = GATConv(hid * heads, hid, heads=heads, dropout=dropout, edge_dim=edge_dim)
+        self.conv3 = GATConv(hid * heads, hid, heads=1, dropout=dropout, edge_dim=edge_dim)
         
         # Batch normalization
         self.bn1 = torch.nn.BatchNorm1d(hid * heads)
@@ -27,19 +42,25 @@ class GrapeGAT(torch.nn.Module):
         self.bn3 = torch.nn.BatchNorm1d(hid)
         
         # MLP classifier (3 pooling strategies * hid + graph features)
-        self.fc1 = torch.nn.Linear(hid * 3 + 5, hid)
+        self.fc1 = torch.nn.Linear(hid * 3 + graph_dim, hid)
         self.fc2 = torch.nn.Linear(hid, out)
     
-    def forward(self, x, edge_index, batch, graph_feats):
+    def forward(self, data):
+        """Logits for a (collated) batch with x, edge_index, batch and graph_feats,
+        plus edge_attr when the model was built with edge_dim."""
+        x, edge_index, batch = data.x, data.edge_index, data.batch
+        x = x * self.node_scale
+        edge_attr = data.edge_attr * self.edge_scale if self.config['edge_dim'] else None
+        
         # GAT convolutions with residual-like structure
         x = F.dropout(x, p=self.dropout, training=self.training)
-        x = F.elu(self.bn1(self.conv1(x, edge_index)))
+        x = F.elu(self.bn1(self.conv1(x, edge_index, edge_attr)))
         
         x = F.dropout(x, p=self.dropout, training=self.training)
-        x = F.elu(self.bn2(self.conv2(x, edge_index)))
+        x = F.elu(self.bn2(self.conv2(x, edge_index, edge_attr)))
         
         x = F.dropout(x, p=self.dropout, training=self.training)
-        x = F.elu(self.bn3(self.conv3(x, edge_index)))
+        x = F.elu(self.bn3(self.conv3(x, edge_index, edge_attr)))
         
         # Multiple pooling strategies
         x_mean = global_mean_pool(x, batch)
@@ -47,7 +68,7 @@ class GrapeGAT(torch.nn.Module):
         x_add = global_add_pool(x, batch)
         
         # Concatenate pooled features with graph-level features
-        x = torch.cat([x_mean, x_max, x_add, graph_feats], dim=1)
+        x = torch.cat([x_mean, x_max, x_add, data.graph_feats], dim=1)
         
         # MLP classifier
         x = F.dropout(x, p=self.dropout, training=self.training)
@@ -55,178 +76,449 @@ class GrapeGAT(torch.nn.Module):
         x = F.dropout(x, p=self.dropout, training=self.training)
         return self.fc2(x)
 
-def compute_graph_features(g, node_map, edges):
-    """Compute graph-level topological features"""
-    num_nodes = len(g)
-    num_edges = len(edges)
-    
-    # Compute degree statistics
-    degree = np.zeros(num_nodes)
-    for e in edges:
-        degree[e[0]] += 1
+def compute_graph_features(x, edge_index):
+    """Graph-level topological features of one graph (see descriptors.DESCRIPTOR_NAMES)"""
+    num_nodes, num_edges = x.shape[0], edge_index.shape[1]
+    return cached_descriptors(x, [0, num_nodes], [0, num_edges], edge_index)[0].tolist()
+
+def _make_data(gid, x, edge_index, label, graph_feats, edge_attr=None):
+    data = Data(x=x, edge_index=edge_index, edge_attr=edge_attr,
+                y=torch.tensor([label]) if label is not None else None)
+    data.gid = gid
+    # Shape [1, F]: DataLoader stacks it into a [num_graphs, F] batch attribute
+    data.graph_feats = torch.as_tensor(graph_feats, dtype=torch.float).view(1, -1)
+    return data
+
+def _graphs_from_arrays(gids, labels, x, node_ptr, indptr, edge_index, edge_attr=None):
+    """Data objects whose x / edge_index / edge_attr are views into dataset-wide
+    tensors. Graph features for the whole dataset are computed in one vectorized pass."""
+    edge_ptr = indptr[node_ptr]
+    feats = cached_descriptors(x.numpy(), node_ptr, edge_ptr, edge_index.numpy())
+    graphs = []
+    for g, gid in enumerate(gids):
+        n0, n1 = node_ptr[g], node_ptr[g + 1]
+        e0, e1 = edge_ptr[g], edge_ptr[g + 1]
+        label = int(labels[gid]) if labels is not None else None
+        graphs.append(_make_data(gid, x[n0:n1], edge_index[:, e0:e1], label, feats[g],
+                                 edge_attr[e0:e1] if edge_attr is not None else None))
+    return graphs
+
+@profiling.timed()
+def load_graph_store(store_dir, label_path=None):
+    """Load a binary graph store written by preprocess.write_graph_store.
+
+    Arrays are memory-mapped, and each graph's x, edge_index and (if the store
+    has edge_attr.npy) edge_attr are views into them, so nothing is parsed or
+    copied per graph. Labels come from `label_path` when given, otherwise from
+    the store's own graphs.csv.
+    """
+    store = Path(store_dir)
+    arrays = {name: np.load(store / f'{name}.npy', mmap_mode='c')
+              for name in ('x', 'node_ptr', 'indptr', 'edge_index')}
+    edge_attr = None
+    if (store / 'edge_attr.npy').exists():
+        edge_attr = torch.from_numpy(np.load(store / 'edge_attr.npy', mmap_mode='c'))
+    meta = pd.read_csv(store / 'graphs.csv')
+    if label_path:
+        labels = _label_map(label_path)
+    elif 'label' in meta.columns:
+        labels = meta.set_index('graph_id')['label']
+    else:
+        labels = None
+    return _graphs_from_arrays(meta['graph_id'], labels, torch.from_numpy(arrays['x']),
+                               arrays['node_ptr'], arrays['indptr'], torch.from_numpy(arrays['edge_index']),
+                               edge_attr)
+
+def _label_map(label_path):
+    labels = pd.read_csv(label_path)
+    return labels.drop_duplicates('graph_id').set_index('graph_id')['label']
+
+# Per-edge attribute columns written by preprocess.graph_rows
+EDGE_ATTR_COLUMNS = ('edge_length', 'edge_tortuosity', 'edge_mean_width', 'edge_min_width')
+# Edge tracers of preprocess.py, and the one the published data/public graphs were built with
+TRACERS = ('segments', 'bfs')
+DATA_TRACER = 'bfs'
+
+def _frame_arrays(df):
+    """Parse a node DataFrame into dataset-wide arrays in one vectorized pass.
+
+    Returns (gids, x, node_ptr, indptr, edge_index, edge_attr) laid out like
+    a graph store: graphs in first-appearance order, each graph's rows in file
+    order, and edges graph-local, ordered by source row then by position in
+    `edges`. edge_attr (E, 4) is None unless all EDGE_ATTR_COLUMNS are present.
+    """
+    gids = pd.unique(df['graph_id'])
+    codes = pd.Categorical(df['graph_id'], categories=gids).codes.astype(np.int64)
+    order = np.argsort(codes, kind='stable')
+    df = df.iloc[order].reset_index(drop=True)
+    codes = codes[order]
+    node_ptr = np.searchsorted(codes, np.arange(len(gids) + 1))
     
-    avg_degree = degree.mean() if num_nodes > 0 else 0
-    max_degree = degree.max() if num_nodes > 0 else 0
+    # Node features: x, y, width, node type (1 junction, 0 endpoint), unscaled
+    node_type_map = {'junction': 1, 'endpoint': 0}
+    type_vals = df['type'].replace(node_type_map).astype(float).values if 'type' in df.columns else np.zeros(len(df))
+    x = np.column_stack([df['x'].values, df['y'].values, df['width'].values, type_vals])
     
-    # Node type distribution
-    junction_ratio = (g['type'] == 'junction').mean() if 'type' in g.columns else 0
+    # Split every adjacency string in one pass and map target node ids to rows
+    adjacency = df['edges'].fillna('').astype(str).tolist()
+    counts = np.fromiter((s.count(';') + 1 if s else 0 for s in adjacency), np.int64, len(adjacency))
+    tokens = ';'.join(s for s in adjacency if s).split(';') if counts.sum() else []
+    src = np.repeat(np.arange(len(df)), counts)
+    valid = np.ones(len(tokens), dtype=bool)
+    try:
+        targets = np.array(tokens, dtype=np.int64)
+    except ValueError:
+        valid = np.fromiter((t.strip().isdigit() for t in tokens), bool, len(tokens))
+        src = src[valid]
+        targets = np.array([t for t, ok in zip(tokens, valid) if ok], dtype=np.int64)
+    nodes = pd.MultiIndex.from_arrays([codes, df['node_id'].astype(np.int64)])
+    dst = nodes.get_indexer(pd.MultiIndex.from_arrays([codes[src], targets]))
     
-    # Average vessel width
-    avg_width = g['width'].mean() if 'width' in g.columns else 0
+    # Edge attributes are ';'-joined in the same order as the adjacency
+    edge_attr = None
+    if all(c in df.columns for c in EDGE_ATTR_COLUMNS):
+        columns = []
+        for c in EDGE_ATTR_COLUMNS:
+            values = df[c].fillna('').astype(str).tolist()
+            joined = ';'.join(v for v, n in zip(values, counts) if n)
+            columns.append(np.array(joined.split(';') if joined else [], dtype=np.float32)[valid])
+        edge_attr = np.column_stack(columns)[dst >= 0]
     
-    return [num_nodes / 500, num_edges / 500, avg_degree / 5, junction_ratio, avg_width / 10]
+    src, dst = src[dst >= 0], dst[dst >= 0]
+    first = node_ptr[codes[src]]
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=len(df)))])
+    edge_index = np.stack([src - first, dst - first])
+    return gids, x, node_ptr, indptr, edge_index, edge_attr
 
+@profiling.timed()
 def load_graphs(graph_path, label_path=None):
-    df = pd.read_csv(graph_path)
-    labels = pd.read_csv(label_path) if label_path else None
-    graphs = []
-    
-    for gid in df['graph_id'].unique():
-        g = df[df['graph_id']==gid].reset_index(drop=True)
-        
-        # Node features: x, y, width + node type encoding
-        node_type_map = {'junction': 0, 'endpoint': 1}
-        type_vals = g['type'].map(lambda t: node_type_map.get(t, 0)).values if 'type' in g.columns else np.zeros(len(g))
-        
-        x = np.column_stack([
-            g['x'].values / 600,
-            g['y'].values / 600,
-            g['width'].values / 20,
-            type_vals,  # Node type
-        ])
-        x = torch.tensor(x, dtype=torch.float)
-        
-        # Build edge list
-        edges = []
-        node_map = {row['node_id']: i for i, row in g.iterrows()}
-        for i, row in g.iterrows():
-            if pd.notna(row['edges']) and row['edges']:
-                for tgt in str(row['edges']).split(';'):
-                    if tgt.strip().isdigit():
-                        tgt_id = int(tgt)
-                        if tgt_id in node_map:
-                            edges.append([i, node_map[tgt_id]])
-        
-        edge_index = torch.tensor(edges, dtype=torch.long).t() if edges else torch.zeros(2,0,dtype=torch.long)
-        
-        # Compute graph-level features
-        graph_feats = compute_graph_features(g, node_map, edges)
-        
-        y = torch.tensor([labels[labels['graph_id']==gid]['label'].values[0]]) if labels is not None else None
-        data = Data(x=x, edge_index=edge_index, y=y)
-        data.gid = gid
-        data.graph_feats = torch.tensor([graph_feats], dtype=torch.float)
-        graphs.append(data)
-    
-    return graphs
+    """Load graphs from a node CSV or, if `graph_path` is a directory, a binary graph store."""
+    if Path(graph_path).is_dir():
+        return load_graph_store(graph_path, label_path)
+    df = pd.read_csv(graph_path, dtype={c: str for c in ('edges',) + EDGE_ATTR_COLUMNS})
+    return graphs_from_frame(df, _label_map(label_path) if label_path else None)
 
-def train():
-    graphs = load_graphs('data/public/train_data.csv', 'data/public/train_labels.csv')
+def graphs_from_frame(df, labels=None):
+    """Graphs of a node DataFrame with the columns of train_data.csv, e.g. the
+    rows of preprocess.graph_rows. `labels` maps graph id to label."""
+    gids, x, node_ptr, indptr, edge_index, edge_attr = _frame_arrays(df)
+    return _graphs_from_arrays(gids, labels, torch.tensor(x, dtype=torch.float),
+                               node_ptr, indptr, torch.tensor(edge_index, dtype=torch.long),
+                               torch.from_numpy(edge_attr) if edge_attr is not None else None)
+
+PROCESSED_VERSION = 3  # Bump whenever load_graphs changes the tensors it builds
+
+def source_digest(graph_path, label_path=None):
+    """Hash of a dataset's source files (CSV or store directory) and label file."""
+    h = hashlib.sha256(f"v{PROCESSED_VERSION}".encode())
+    paths = sorted(Path(graph_path).iterdir()) if Path(graph_path).is_dir() else [Path(graph_path)]
+    if label_path:
+        paths.append(Path(label_path))
+    for path in paths:
+        h.update(path.name.encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    return h.hexdigest()[:16]
+
+class GrapeDataset(InMemoryDataset):
+    """
+    Graphs of one CSV or graph store, collated once and cached on disk.
+    - Processed tensors (x, edge_index, y, graph_feats, gid and slices) are
+      saved under `root`, keyed by a hash of the source files
+    - Later runs load them with a single torch.load instead of re-parsing
+    """
+    def __init__(self, graph_path, label_path=None, root='data/processed', transform=None):
+        self.graph_path, self.label_path = graph_path, label_path
+        self.digest = source_digest(graph_path, label_path)
+        super().__init__(root, transform=transform, log=False)
+        self.load(self.processed_paths[0])
     
-    # Split into train/val (80/20)
-    np.random.seed(42)
-    indices = np.random.permutation(len(graphs))
-    val_size = int(0.2 * len(graphs))
-    val_idx, train_idx = indices[:val_size], indices[val_size:]
+    @property
+    def processed_dir(self):
+        return self.root
     
-    train_graphs = [graphs[i] for i in train_idx]
-    val_graphs = [graphs[i] for i in val_idx]
-    print(f"Train: {len(train_graphs)}, Val: {len(val_graphs)}")
+    @property
+    def processed_file_names(self):
+        return [f"{Path(self.graph_path).stem}-{self.digest}.pt"]
+    
+    def process(self):
+        # Write then rename so concurrent jobs never load a partial file
+        path = Path(self.processed_paths[0])
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        self.save(load_graphs(self.graph_path, self.label_path), str(tmp))
+        os.replace(tmp, path)
+
+def fit(graphs, train_idx, val_idx, seed=None, hid=64, heads=4, dropout=0.3, lr=0.005,
+        weight_decay=1e-4, max_nodes=2000, max_edges=None, epochs=300, patience=30, augment=False,
+        verbose=True, state=None):
+    """Train GrapeGAT on graphs[train_idx] with early stopping on the accuracy
+    of graphs[val_idx]. Returns (model with the best weights, best val accuracy).
+
+    `augment` (True, or a dict of BatchAugment arguments) augments every
+    training batch after collation.
+
+    If `state` is a dict, training resumes from it when it is non-empty and it
+    is left holding the full training state, so a later call with a larger
+    `epochs` continues where this one stopped.
+    """
+    if seed is not None:
+        torch.manual_seed(seed)
+    train_graphs = graphs[torch.as_tensor(train_idx)]
+    val_graphs = graphs[torch.as_tensor(val_idx)]
     
     # Compute class weights for imbalanced data
     labels = [g.y.item() for g in train_graphs]
-    class_counts = np.bincount(labels)
-    class_weights = torch.tensor([1.0 / c for c in class_counts], dtype=torch.float)
+    class_counts = np.bincount(labels, minlength=2)
+    class_weights = torch.tensor([1.0 / max(c, 1) for c in class_counts], dtype=torch.float)
     class_weights = class_weights / class_weights.sum() * 2  # Normalize
-    print(f"Class weights: {class_weights.tolist()}")
+    if verbose:
+        print(f"Class weights: {class_weights.tolist()}")
     
-    train_loader = DataLoader(train_graphs, batch_size=8, shuffle=True)
-    val_loader = DataLoader(val_graphs, batch_size=8, shuffle=False)
+    # Size-bucketed batches under a node / edge budget, reshuffled every epoch
+    sampler_seed = int(torch.randint(2**31, ())) if seed is None else seed
+    sampler = BucketBatchSampler([g.num_nodes for g in train_graphs], [g.num_edges for g in train_graphs],
+                                 max_nodes, max_edges, seed=sampler_seed)
+    augmenter = None
+    if augment:
+        augmenter = BatchAugment(**(augment if isinstance(augment, dict) else {}), seed=sampler_seed)
+    train_loader = DataLoader(train_graphs, batch_sampler=sampler)
+    val_loader = DataLoader(val_graphs, batch_sampler=node_budget_batches(
+        [g.num_nodes for g in val_graphs], max_nodes, num_edges=[g.num_edges for g in val_graphs], max_edges=max_edges))
     
-    model = GrapeGAT(in_dim=4, hid=64, out=2, heads=4, dropout=0.3)
-    opt = torch.optim.AdamW(model.parameters(), lr=0.005, weight_decay=1e-4)
+    model = GrapeGAT(in_dim=4, hid=hid, out=2, heads=heads, dropout=dropout,
+                     edge_dim=graphs[0].num_edge_features or None)
+    opt = torch.optim.AdamW(model.parameters(), lr=lr, weight_decay=weight_decay)
     scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(opt, T_max=200)
     
+    ep = 0
     best_val_acc = 0
-    patience = 30
     patience_counter = 0
-    best_model_state = None
-    
-    for ep in range(300):
-        # Training
-        model.train()
-        total_loss = 0
-        correct = 0
-        total = 0
-        
-        for batch in train_loader:
-            opt.zero_grad()
-            graph_feats = torch.cat([train_graphs[i].graph_feats for i in range(len(batch.y))], dim=0)
-            out = model(batch.x, batch.edge_index, batch.batch, graph_feats)
-            loss = F.cross_entropy(out, batch.y, weight=class_weights)
-            loss.backward()
-            opt.step()
+    best_model_state = {k: v.clone() for k, v in model.state_dict().items()}
+    if state:
+        model.load_state_dict(state['model'])
+        opt.load_state_dict(state['opt'])
+        scheduler.load_state_dict(state['scheduler'])
+        torch.set_rng_state(state['rng'])
+        if augmenter is not None:
+            augmenter.generator.set_state(state['augment_rng'])
+        ep, best_val_acc = state['epoch'], state['best_val_acc']
+        patience_counter, best_model_state = state['patience_counter'], state['best_model']
+    
+    while ep < epochs and patience_counter < patience:
+        with profiling.scope('epoch', ep):
+            # Training
+            model.train()
+            sampler.set_epoch(ep)
+            total_loss = 0
+            correct = 0
+            total = 0
             
-            total_loss += loss.item()
-            pred = out.argmax(dim=1)
-            correct += (pred == batch.y).sum().item()
-            total += len(batch.y)
-        
-        scheduler.step()
-        train_acc = correct / total
-        
-        # Validation
-        model.eval()
-        val_correct = 0
-        val_total = 0
-        with torch.no_grad():
-            for batch in val_loader:
-                graph_feats = torch.cat([val_graphs[i].graph_feats for i in range(len(batch.y))], dim=0)
-                out = model(batch.x, batch.edge_index, batch.batch, graph_feats)
+            for batch in profiling.timed_iter(train_loader, 'load_batch'):
+                if augmenter is not None:
+                    with profiling.timer('augment'):
+                        batch = augmenter(batch)
+                opt.zero_grad()
+                with profiling.timer('forward'):
+                    out = model(batch)
+                    loss = F.cross_entropy(out, batch.y, weight=class_weights)
+                with profiling.timer('backward'):
+                    loss.backward()
+                with profiling.timer('optimizer'):
+                    opt.step()
+                profiling.count('batches')
+                profiling.count('nodes', batch.num_nodes)
+                
+                total_loss += loss.item()
                 pred = out.argmax(dim=1)
-                val_correct += (pred == batch.y).sum().item()
-                val_total += len(batch.y)
-        
-        val_acc = val_correct / val_total
-        
-        # Early stopping on validation accuracy
-        if val_acc > best_val_acc:
-            best_val_acc = val_acc
-            patience_counter = 0
-            best_model_state = {k: v.clone() for k, v in model.state_dict().items()}
-        else:
-            patience_counter += 1
-        
-        if (ep+1) % 10 == 0:
-            print(f"Epoch {ep+1}: loss={total_loss/len(train_loader):.4f}, train_acc={train_acc*100:.1f}%, val_acc={val_acc*100:.1f}%")
-        
-        if patience_counter >= patience:
-            print(f"Early stopping at epoch {ep+1}")
-            break
+                correct += (pred == batch.y).sum().item()
+                total += len(batch.y)
+            
+            scheduler.step()
+            train_acc = correct / total
+            
+            # Validation
+            model.eval()
+            val_correct = 0
+            val_total = 0
+            with torch.no_grad(), profiling.timer('validate'):
+                for batch in val_loader:
+                    out = model(batch)
+                    pred = out.argmax(dim=1)
+                    val_correct += (pred == batch.y).sum().item()
+                    val_total += len(batch.y)
+            
+            val_acc = val_correct / val_total
+            
+            # Early stopping on validation accuracy
+            if val_acc > best_val_acc:
+                best_val_acc = val_acc
+                patience_counter = 0
+                best_model_state = {k: v.clone() for k, v in model.state_dict().items()}
+            else:
+                patience_counter += 1
+            
+            ep += 1
+            if verbose and ep % 10 == 0:
+                print(f"Epoch {ep}: loss={total_loss/len(train_loader):.4f}, train_acc={train_acc*100:.1f}%, val_acc={val_acc*100:.1f}%")
+    
+    if verbose and patience_counter >= patience:
+        print(f"Early stopping at epoch {ep}")
+    if state is not None:
+        state.update(model={k: v.clone() for k, v in model.state_dict().items()}, opt=opt.state_dict(),
+                     scheduler=scheduler.state_dict(), rng=torch.get_rng_state(), epoch=ep,
+                     best_val_acc=best_val_acc, patience_counter=patience_counter, best_model=best_model_state,
+                     stopped=patience_counter >= patience)
+        if augmenter is not None:
+            state['augment_rng'] = augmenter.generator.get_state()
     
     # Load best model
     model.load_state_dict(best_model_state)
+    return model, best_val_acc
+
+def train(graph_path='data/public/train_data.csv', label_path='data/public/train_labels.csv'):
+    with profiling.timer('load_dataset'):
+        graphs = GrapeDataset(graph_path, label_path)
+    
+    # Split into train/val (80/20)
+    np.random.seed(42)
+    indices = np.random.permutation(len(graphs))
+    val_size = int(0.2 * len(graphs))
+    val_idx, train_idx = indices[:val_size], indices[val_size:]
+    print(f"Train: {len(train_idx)}, Val: {len(val_idx)}")
+    
+    model, best_val_acc = fit(graphs, train_idx, val_idx)
     print(f"Best validation accuracy: {best_val_acc*100:.1f}%")
     return model
 
-def predict(model, graph_path, out_path):
-    graphs = load_graphs(graph_path)
-    preds = []
+def save_checkpoint(model, path, tracer=DATA_TRACER, **meta):
+    """Save a GrapeGAT's constructor arguments and weights, plus any metadata.
+
+    `tracer` is the preprocess.py edge tracer the training graphs were built
+    with; serve.py extracts uploaded masks with the same one.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    torch.save({'config': model.config, 'state_dict': model.state_dict(),
+                'extraction': {'tracer': tracer}, **meta}, path)
+
+def load_checkpoint(path):
+    """Rebuild the GrapeGAT saved by save_checkpoint. Returns (model, checkpoint dict)."""
+    ckpt = torch.load(path, map_location='cpu', weights_only=True)
+    model = GrapeGAT(**ckpt['config'])
+    model.load_state_dict(ckpt['state_dict'])
+    return model.eval(), ckpt
+
+def node_budget_batches(num_nodes, max_nodes=20000, max_graphs=256, num_edges=None, max_edges=None):
+    """Split graph indices, in order, into batches of at most `max_nodes` nodes,
+    `max_edges` edges (if given) and `max_graphs` graphs. A graph larger than
+    the budget gets its own batch."""
+    if num_edges is None:
+        num_edges, max_edges = [0] * len(num_nodes), None
+    batches, current, nodes, edges = [], [], 0, 0
+    for i, (n, e) in enumerate(zip(num_nodes, num_edges)):
+        if current and (nodes + n > max_nodes or len(current) >= max_graphs
+                        or (max_edges is not None and edges + e > max_edges)):
+            batches.append(current)
+            current, nodes, edges = [], 0, 0
+        current.append(i)
+        nodes += n
+        edges += e
+    if current:
+        batches.append(current)
+    return batches
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    """
+    Batch sampler packing graphs of similar size under a node / edge budget.
+    - Graphs are sorted by node count with a random multiplicative jitter,
+      so neighbouring sizes are bucketed together but differently each epoch
+    - Batches are filled greedily up to max_nodes / max_edges, then shuffled
+    - The order depends only on (seed, epoch); call set_epoch before each epoch
+    """
+    def __init__(self, num_nodes, num_edges=None, max_nodes=2000, max_edges=None, max_graphs=256,
+                 jitter=0.1, seed=0, shuffle=True):
+        self.num_nodes = np.asarray(num_nodes)
+        self.num_edges = None if num_edges is None else np.asarray(num_edges)
+        self.max_nodes, self.max_edges, self.max_graphs = max_nodes, max_edges, max_graphs
+        self.jitter, self.seed, self.shuffle = jitter, seed, shuffle
+        self.set_epoch(0)
+    
+    def set_epoch(self, epoch):
+        rng = np.random.default_rng([self.seed, epoch])
+        key = self.num_nodes.astype(np.float64)
+        if self.shuffle:
+            key = key * np.exp(rng.uniform(-self.jitter, self.jitter, len(key)))
+        order = np.argsort(key, kind='stable')
+        edges = None if self.num_edges is None else self.num_edges[order]
+        batches = node_budget_batches(self.num_nodes[order], self.max_nodes, self.max_graphs, edges, self.max_edges)
+        self.batches = [order[b].tolist() for b in batches]
+        if self.shuffle:
+            self.batches = [self.batches[i] for i in rng.permutation(len(self.batches))]
+    
+    def __iter__(self):
+        return iter(self.batches)
+    
+    def __len__(self):
+        return len(self.batches)
+
+def infer(model, graphs, max_nodes=20000, max_graphs=256, compile=False):
+    """Class probabilities for all graphs, scored in size-capped mini-batches.
+
+    Runs under torch.inference_mode; `compile=True` wraps the model with
+    torch.compile first. Returns (gids, probs, stats) where stats has
+    graphs_per_sec and p50/p99 per-batch latency in milliseconds.
+    """
     model.eval()
+    forward = torch.compile(model, dynamic=True) if compile else model
+    batches = node_budget_batches([g.num_nodes for g in graphs], max_nodes, max_graphs)
+    loader = DataLoader(graphs, batch_sampler=batches)
     
-    with torch.no_grad():
-        for g in graphs:
-            out = model(g.x, g.edge_index, torch.zeros(g.x.size(0), dtype=torch.long), g.graph_feats)
-            pred = out.argmax(dim=1).item()
-            preds.append({'graph_id': g.gid, 'label': pred})
+    gids, probs, latencies = [], [], []
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for batch in loader:
+            t0 = time.perf_counter()
+            out = forward(batch)
+            probs.append(F.softmax(out, dim=1))
+            latencies.append(time.perf_counter() - t0)
+            gids.extend(batch.gid)
+    elapsed = time.perf_counter() - start
+    
+    stats = {
+        'graphs': len(gids),
+        'batches': len(latencies),
+        'graphs_per_sec': len(gids) / elapsed if elapsed > 0 else float('inf'),
+        'p50_ms': float(np.percentile(latencies, 50)) * 1000 if latencies else 0.0,
+        'p99_ms': float(np.percentile(latencies, 99)) * 1000 if latencies else 0.0,
+    }
+    return gids, torch.cat(probs) if probs else torch.zeros(0, 2), stats
+
+def predict(model, graph_path, out_path, max_nodes=20000, compile=False):
+    graphs = GrapeDataset(graph_path)
+    gids, probs, stats = infer(model, graphs, max_nodes=max_nodes, compile=compile)
+    preds = [{'graph_id': gid, 'label': int(p)} for gid, p in zip(gids, probs.argmax(dim=1).tolist())]
     
     pd.DataFrame(preds).to_csv(out_path, index=False)
     print(f"Saved predictions to {out_path}")
+    print(f"Inference: {stats['graphs']} graphs in {stats['batches']} batches, "
+          f"{stats['graphs_per_sec']:.1f} graphs/s, p50={stats['p50_ms']:.1f}ms, p99={stats['p99_ms']:.1f}ms")
     
     # Show prediction distribution
     pred_df = pd.DataFrame(preds)
     print(f"Prediction distribution: {pred_df['label'].value_counts().to_dict()}")
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Train the GAT baseline and predict the public test set.")
+    parser.add_argument('--profile', type=Path, metavar='REPORT',
+                        help="time data loading and the training steps, and write REPORT.json / REPORT.csv "
+                             "with per-epoch breakdowns")
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable()
     model = train()
-    predict(model, 'data/public/test_data.csv', 'submission.csv')
+    with profiling.timer('predict'):
+        predict(model, 'data/public/test_data.csv', 'submission.csv')
+    if args.profile:
+        report = profiling.write_report(args.profile)
+        print(f"Profile written to {args.profile.with_suffix('.json')} (peak RSS {report['meta']['peak_rss_mb']:.0f} MB)")
@@ -0,0 +1,42 @@
+"""Per-epoch training time of GrapeGAT with graph-level features gathered per
+step by index (the old train loop) versus collated into the Batch."""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from baseline import DataLoader, GrapeDataset, GrapeGAT
+
+
+def run_epoch(model, opt, loader, graphs, gather):
+    model.train()
+    start = time.perf_counter()
+    for batch in loader:
+        opt.zero_grad()
+        if gather:
+            batch.graph_feats = torch.cat([graphs[i].graph_feats for i in range(len(batch.y))], dim=0)
+        loss = F.cross_entropy(model(batch), batch.y)
+        loss.backward()
+        opt.step()
+    return time.perf_counter() - start
+
+
+def main(epochs=20, batch_size=8):
+    root = Path(__file__).resolve().parents[1] / 'data' / 'public'
+    graphs = list(GrapeDataset(root / 'train_data.csv', root / 'train_labels.csv'))
+    for name, gather in (("index gather", True), ("collated", False)):
+        torch.manual_seed(0)
+        model = GrapeGAT(in_dim=4)
+        opt = torch.optim.AdamW(model.parameters(), lr=0.005, weight_decay=1e-4)
+        loader = DataLoader(graphs, batch_size=batch_size, shuffle=True)
+        times = [run_epoch(model, opt, loader, graphs, gather) for _ in range(epochs)]
+        print(f"{name:>12}: median {np.median(times)*1000:.1f} ms/epoch, "
+              f"mean {np.mean(times)*1000:.1f} ms/epoch over {epochs} epochs")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,47 @@
+"""Spread of per-step training time and batch size (nodes) with a fixed
+graph count per batch versus size-bucketed batches under a node budget."""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from baseline import BucketBatchSampler, DataLoader, GrapeDataset, GrapeGAT
+
+
+def run(loader, epochs, sampler=None):
+    torch.manual_seed(0)
+    model = GrapeGAT(in_dim=4)
+    opt = torch.optim.AdamW(model.parameters(), lr=0.005, weight_decay=1e-4)
+    model.train()
+    times, nodes = [], []
+    for ep in range(epochs):
+        if sampler is not None:
+            sampler.set_epoch(ep)
+        for batch in loader:
+            start = time.perf_counter()
+            opt.zero_grad()
+            F.cross_entropy(model(batch), batch.y).backward()
+            opt.step()
+            times.append(time.perf_counter() - start)
+            nodes.append(batch.num_nodes)
+    return np.array(times) * 1000, np.array(nodes)
+
+
+def main(epochs=5, batch_size=8, max_nodes=2000):
+    root = Path(__file__).resolve().parents[1] / 'data' / 'public'
+    graphs = GrapeDataset(root / 'train_data.csv', root / 'train_labels.csv')
+    sampler = BucketBatchSampler([g.num_nodes for g in graphs], [g.num_edges for g in graphs], max_nodes)
+    for name, loader, s in ((f"{batch_size} graphs", DataLoader(graphs, batch_size=batch_size, shuffle=True), None),
+                            (f"{max_nodes} nodes", DataLoader(graphs, batch_sampler=sampler), sampler)):
+        times, nodes = run(loader, epochs, s)
+        print(f"{name:>12}: step {times.mean():.1f} +/- {times.std():.1f} ms (max {times.max():.1f}), "
+              f"nodes {nodes.mean():.0f} +/- {nodes.std():.0f} (max {nodes.max()}), "
+              f"{times.sum() / epochs:.0f} ms/epoch")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:4]))
@@ -1,17 +1,119 @@
+import numpy as np
 import pandas as pd
-import sys
-from metrics import macro_f1, auroc
+from metrics import macro_f1, auroc, macro_f1_batch, auroc_batch
 
-def main(pred_path, label_path):
-    preds = pd.read_csv(pred_path).sort_values("graph_id")
-    labels = pd.read_csv(label_path).sort_values("graph_id")
-    merged = labels.merge(preds, on="graph_id", how="inner", suffixes=('_true','_pred'))
+BATCHED = {"MACRO_F1": macro_f1_batch, "AUROC": auroc_batch}
+CHUNK = 20000  # resamples scored per vectorized pass, bounds memory on large test sets
+
+def bootstrap_indices(y_true, n_resamples, rng):
+    """(n_resamples, n) index matrix of stratified bootstrap resamples: every
+    class is resampled with replacement within itself, so each resample keeps
+    the test set's class counts (and AUROC stays defined)."""
+    y_true = np.asarray(y_true)
+    columns = []
+    for c in np.unique(y_true):
+        members = np.flatnonzero(y_true == c)
+        columns.append(members[rng.integers(0, len(members), size=(n_resamples, len(members)))])
+    return np.concatenate(columns, axis=1)
+
+def _chunks(total):
+    for start in range(0, total, CHUNK):
+        yield min(CHUNK, total - start)
+
+def bootstrap_ci(y_true, y_pred, metric, n_resamples=10000, alpha=0.05, seed=0):
+    """Percentile bootstrap interval (low, high) of a batched metric."""
+    y_true, y_pred = np.asarray(y_true), np.asarray(y_pred)
+    rng = np.random.default_rng(seed)
+    scores = np.concatenate([metric(y_true, y_pred, bootstrap_indices(y_true, n, rng))
+                             for n in _chunks(n_resamples)])
+    low, high = np.nanpercentile(scores, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+    return float(low), float(high)
+
+def paired_bootstrap(y_true, pred_a, pred_b, metric, n_resamples=10000, alpha=0.05, seed=0):
+    """Bootstrap of metric(a) - metric(b), both scored on the same resamples.
+
+    Returns (delta, low, high, p) with p the two-sided bootstrap p-value of
+    no difference.
+    """
+    y_true, pred_a, pred_b = np.asarray(y_true), np.asarray(pred_a), np.asarray(pred_b)
+    rng = np.random.default_rng(seed)
+    deltas = []
+    for n in _chunks(n_resamples):
+        idx = bootstrap_indices(y_true, n, rng)
+        deltas.append(metric(y_true, pred_a, idx) - metric(y_true, pred_b, idx))
+    deltas = np.concatenate(deltas)
+    deltas = deltas[~np.isnan(deltas)]
+    delta = float(metric(y_true, pred_a)[0] - metric(y_true, pred_b)[0])
+    low, high = np.percentile(deltas, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+    p = min(1.0, 2 * min((deltas <= 0).mean(), (deltas >= 0).mean()))
+    return delta, float(low), float(high), float(p)
+
+def permutation_test(y_true, pred_a, pred_b, metric, n_permutations=10000, seed=0):
+    """Paired permutation test of metric(a) == metric(b): each permutation
+    swaps the two submissions' predictions on a random subset of graphs.
+    Returns the two-sided p-value."""
+    y_true, pred_a, pred_b = np.asarray(y_true), np.asarray(pred_a), np.asarray(pred_b)
+    rng = np.random.default_rng(seed)
+    observed = abs(metric(y_true, pred_a)[0] - metric(y_true, pred_b)[0])
+    # Index into [a, b]: position i of a permutation reads a[i] or, swapped, b[i]
+    truth, both = np.tile(y_true, 2), np.concatenate([pred_a, pred_b])
+    extreme = 0
+    for n in _chunks(n_permutations):
+        swap = (rng.random((n, len(y_true))) < 0.5) * len(y_true) + np.arange(len(y_true))
+        diff = np.abs(metric(truth, both, swap) - metric(truth, both, (swap + len(y_true)) % (2 * len(y_true))))
+        extreme += int((diff >= observed - 1e-12).sum())
+    return (extreme + 1) / (n_permutations + 1)
+
+def align(preds, labels):
+    """Labels and predictions side by side (label_true, label_pred), sorted by graph_id."""
+    merged = labels.sort_values("graph_id").merge(preds, on="graph_id", how="inner", suffixes=('_true','_pred'))
     if len(merged) != len(labels):
         raise ValueError("ID mismatch")
+    return merged
+
+def main(pred_path, label_path, resamples=0, compare=None, alpha=0.05, seed=0):
+    labels = pd.read_csv(label_path)
+    merged = align(pd.read_csv(pred_path), labels)
     f1 = macro_f1(merged["label_true"], merged["label_pred"])
     auc = auroc(merged["label_true"], merged["label_pred"])
     print(f"MACRO_F1={f1:.6f}")
     print(f"AUROC={auc:.6f}")
+    if not resamples:
+        return
+
+    y_true, y_pred = merged["label_true"].to_numpy(), merged["label_pred"].to_numpy()
+    level = int(round(100 * (1 - alpha)))
+    for name, metric in BATCHED.items():
+        low, high = bootstrap_ci(y_true, y_pred, metric, resamples, alpha, seed)
+        print(f"{name}_CI{level}={low:.6f},{high:.6f}")
+    if compare is None:
+        return
+
+    other = pd.read_csv(compare)[["graph_id", "label"]].rename(columns={"label": "label_other"})
+    merged = merged.merge(other, on="graph_id", how="inner")
+    if len(merged) != len(labels):
+        raise ValueError("ID mismatch in compared submission")
+    y_true, y_pred, y_other = (merged[c].to_numpy() for c in ("label_true", "label_pred", "label_other"))
+    for name, metric in BATCHED.items():
+        delta, low, high, p_boot = paired_bootstrap(y_true, y_pred, y_other, metric, resamples, alpha, seed)
+        p_perm = permutation_test(y_true, y_pred, y_other, metric, resamples, seed)
+        print(f"{name}_DELTA={delta:.6f}")
+        print(f"{name}_DELTA_CI{level}={low:.6f},{high:.6f}")
+        print(f"{name}_P_BOOTSTRAP={p_boot:.6f}")
+        print(f"{name}_P_PERMUTATION={p_perm:.6f}")
 
 if __name__ == "__main__":
-    main(sys.argv[1], sys.argv[2])
+    import argparse
+    parser = argparse.ArgumentParser(description="Score a submission against the test labels.")
+    parser.add_argument("predictions")
+    parser.add_argument("labels")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                        help="also print stratified bootstrap confidence intervals from N resamples")
+    parser.add_argument("--compare", metavar="PREDICTIONS",
+                        help="with --bootstrap, paired bootstrap and permutation tests against another submission")
+    parser.add_argument("--alpha", type=float, default=0.05, help="1 - confidence level (default: 0.05)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.compare and not args.bootstrap:
+        parser.error("--compare needs --bootstrap N")
+    main(args.predictions, args.labels, args.bootstrap, args.compare, args.alpha, args.seed)
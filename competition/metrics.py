@@ -1,3 +1,4 @@
+import numpy as np
 from sklearn.metrics import f1_score, roc_auc_score
 
 def macro_f1(y_true, y_pred):
@@ -8,3 +9,50 @@ def auroc(y_true, y_pred):
         return float(roc_auc_score(y_true, y_pred))
     except ValueError:
         return 0.0  # If only one class present
+
+def _rows(y_true, y_other, index):
+    # (R, n) views of both arrays: gathered through an index matrix, or as given
+    y_true, y_other = np.asarray(y_true), np.asarray(y_other)
+    if index is None:
+        return np.atleast_2d(y_true), np.atleast_2d(y_other)
+    return y_true[index], y_other[index]
+
+def macro_f1_batch(y_true, y_pred, index=None):
+    """macro_f1 of many label arrays at once.
+
+    Scores every row of (R, n) arrays, or, with an (R, n) `index` matrix
+    (e.g. bootstrap resamples), y_true[index] against y_pred[index] without
+    the caller materialising them. Like sklearn, each row averages over the
+    classes present in its y_true or y_pred. Returns an (R,) float array.
+    """
+    classes = np.union1d(y_true, y_pred)
+    y_true, y_pred = _rows(y_true, y_pred, index)
+    scores, present = 0.0, 0
+    for c in classes:
+        is_true, is_pred = y_true == c, y_pred == c
+        tp = (is_true & is_pred).sum(axis=1)
+        denom = is_true.sum(axis=1) + is_pred.sum(axis=1)  # 2tp + fp + fn
+        scores = scores + np.where(denom > 0, 2 * tp / np.maximum(denom, 1), 0.0)
+        present = present + (denom > 0)
+    return scores / np.maximum(present, 1)
+
+def auroc_batch(y_true, y_score, index=None):
+    """auroc of many binary label / score arrays at once, rows as in macro_f1_batch.
+
+    Uses the rank-sum form: scores are mapped to their distinct values and
+    each row is reduced to per-value counts of positives and negatives, so
+    ties count one half and no row is sorted. Returns an (R,) float array;
+    rows with only one class give NaN rather than auroc's 0.0.
+    """
+    values, codes = np.unique(y_score, return_inverse=True)
+    codes = codes.reshape(np.shape(y_score))
+    positive, codes = _rows(np.asarray(y_true) == 1, codes, index)
+    rows, k = codes.shape[0], len(values)
+    flat = codes + k * np.arange(rows)[:, None]
+    pos_counts = np.bincount(flat[positive], minlength=rows * k).reshape(rows, k)
+    neg_counts = np.bincount(flat.ravel(), minlength=rows * k).reshape(rows, k) - pos_counts
+    neg_below = np.cumsum(neg_counts, axis=1) - neg_counts
+    n_pos, n_neg = pos_counts.sum(axis=1), neg_counts.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        auc = (pos_counts * (neg_below + 0.5 * neg_counts)).sum(axis=1) / (n_pos * n_neg)
+    return np.where((n_pos > 0) & (n_neg > 0), auc, np.nan)
@@ -1,57 +1,173 @@
+"""Render leaderboard.md, docs/leaderboard.csv and the paged JSON read by
+docs/leaderboard.js from leaderboard/leaderboard.csv.
+
+Results are kept ranked in leaderboard/index.json together with how far the
+append-only CSV has been read and a hash of that part. A run parses only the
+rows appended since, inserts each at its sorted position and shifts the
+ranks below it, then rewrites the markdown rows and JSON pages from the
+first changed position on. If earlier CSV rows were edited the index is
+rebuilt (also --rebuild).
+"""
+import bisect
 import csv
+import hashlib
+import io
+import json
+import math
+import os
+import shutil
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
 
 ROOT = Path(__file__).resolve().parents[1]
 CSV_PATH = ROOT / "leaderboard" / "leaderboard.csv"
 MD_PATH = ROOT / "leaderboard" / "leaderboard.md"
+INDEX_PATH = ROOT / "leaderboard" / "index.json"
+DOCS_CSV_PATH = ROOT / "docs" / "leaderboard.csv"
+PAGES_DIR = ROOT / "docs" / "leaderboard"
+PAGE_SIZE = 100
+FIELDS = ["timestamp_utc", "team", "model", "score", "notes"]
+
+MD_HEADER = ("# Leaderboard\n"
+             "This leaderboard is **auto-updated** when a submission PR is merged. "
+             "For interactive search and filters, enable GitHub Pages and open **/docs/leaderboard.html**.\n\n"
+             "| Rank | Team | Model | Score | Date (UTC) | Notes |\n"
+             "|---:|---|---|---:|---|---|\n")
+
+def sort_key(r, seq):
+  """Best score first, then newest first, then CSV order; unparsable scores last."""
+  try:
+    score = float(r["score"])
+  except:
+    score = math.nan
+  try:
+    ts = datetime.fromisoformat(r["timestamp_utc"].replace("Z","+00:00"))
+    ts = (ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)).timestamp()
+  except:
+    ts = 0.0
+  if not math.isfinite(score):
+    return (1, 0.0, -ts, seq)
+  return (0, -score, -ts, seq)
+
+def parse_rows(data, header=None):
+  """(header, rows) of CSV bytes; `header` is given when `data` starts mid-file."""
+  reader = csv.DictReader(io.StringIO(data.decode("utf-8-sig")), fieldnames=header)
+  rows = [{k: (r.get(k) or "").strip() for k in FIELDS} for r in reader if (r.get("team") or "").strip()]
+  return reader.fieldnames, rows
+
+class LeaderboardIndex:
+  """Leaderboard rows in ranked order, each with its rank, plus their sort keys."""
+
+  def __init__(self, header=None, rows=None, keys=None, csv_offset=0, csv_sha256="", page_size=PAGE_SIZE):
+    self.header = header
+    self.rows = rows or []
+    self.keys = keys or []
+    self.csv_offset = csv_offset
+    self.csv_sha256 = csv_sha256
+    self.page_size = page_size
+    self.dirty = len(self.rows)  # first position whose row or rank changed in this run
+
+  @classmethod
+  def load(cls, path=None):
+    path = path or INDEX_PATH
+    if not path.exists():
+      return None
+    state = json.loads(path.read_text(encoding="utf-8"))
+    return cls(state["header"], state["rows"], [tuple(k) for k in state["keys"]],
+               state["csv_offset"], state["csv_sha256"], state["page_size"])
+
+  @classmethod
+  def build(cls, data, page_size=PAGE_SIZE):
+    """Index of a whole CSV file's bytes."""
+    header, rows = parse_rows(data)
+    keys = [sort_key(r, i) for i, r in enumerate(rows)]
+    order = sorted(range(len(rows)), key=keys.__getitem__)
+    index = cls(header, [rows[i] for i in order], [keys[i] for i in order], page_size=page_size)
+    for i, r in enumerate(index.rows):
+      r["rank"] = index.rows[i-1]["rank"] if i and index.keys[i][:2] == index.keys[i-1][:2] else i + 1
+    index.dirty = 0
+    return index
+
+  def insert(self, row):
+    """Insert `row` at its sorted position; rows tied on score share the rank of the first."""
+    key = sort_key(row, len(self.rows))
+    pos = bisect.bisect(self.keys, key)
+    self.keys.insert(pos, key)
+    self.rows.insert(pos, row)
+    tied = lambda i: self.keys[i][:2] == key[:2]
+    row["rank"] = self.rows[pos-1]["rank"] if pos and tied(pos - 1) else pos + 1
+    i = pos + 1
+    while i < len(self.rows) and tied(i):
+      i += 1  # the rest of its tie group keeps its rank
+    for r in self.rows[i:]:
+      r["rank"] += 1
+    self.dirty = min(self.dirty, pos)
+
+  def save(self, path=None):
+    state = {"header": self.header, "csv_offset": self.csv_offset, "csv_sha256": self.csv_sha256,
+             "page_size": self.page_size, "keys": self.keys, "rows": self.rows}
+    write_text(path or INDEX_PATH, json.dumps(state, separators=(",",":")))
+
+def write_text(path, text):
+  tmp = path.with_name(path.name + ".tmp")
+  tmp.write_text(text, encoding="utf-8")
+  os.replace(tmp, path)
+
+def md_line(r):
+  cells = [str(r["rank"]), r["team"], f"`{r['model']}`" if r["model"] else "", r["score"], r["timestamp_utc"], r["notes"]]
+  return "| " + " | ".join(c.replace("\r", " ").replace("\n", " ") for c in cells) + " |\n"
+
+def write_markdown(index):
+  """Rewrite leaderboard.md, reusing the unchanged lines above `index.dirty`."""
+  keep = []
+  if index.dirty and MD_PATH.exists():
+    text = MD_PATH.read_text(encoding="utf-8")
+    if text.startswith(MD_HEADER):
+      keep = text[len(MD_HEADER):].split("\n")[:index.dirty]
+  if len(keep) < index.dirty:
+    keep, index.dirty = [], 0
+  write_text(MD_PATH, MD_HEADER + "".join(line + "\n" for line in keep)
+             + "".join(md_line(r) for r in index.rows[index.dirty:]))
+
+def write_pages(index):
+  """Rewrite the JSON pages from the one holding `index.dirty` on, and meta.json."""
+  PAGES_DIR.mkdir(parents=True, exist_ok=True)
+  size = index.page_size
+  n_pages = max(1, math.ceil(len(index.rows) / size))
+  for p in range(min(index.dirty // size, n_pages - 1), n_pages):
+    rows = [{"rank": r["rank"], **{k: r[k] for k in FIELDS}} for r in index.rows[p*size:(p+1)*size]]
+    write_text(PAGES_DIR / f"page-{p}.json", json.dumps(rows, separators=(",",":")))
+  for path in PAGES_DIR.glob("page-*.json"):
+    if int(path.stem[5:]) >= n_pages:
+      path.unlink()
+  meta = {"total": len(index.rows), "page_size": size, "pages": n_pages,
+          "models": sorted({r["model"] for r in index.rows if r["model"]})}
+  write_text(PAGES_DIR / "meta.json", json.dumps(meta, separators=(",",":")))
+
+def main(rebuild=False, page_size=PAGE_SIZE):
+  data = CSV_PATH.read_bytes() if CSV_PATH.exists() else b""
+  index = None if rebuild else LeaderboardIndex.load()
+  if (index is None or index.page_size != page_size
+      or hashlib.sha256(data[:index.csv_offset]).hexdigest() != index.csv_sha256):
+    index = LeaderboardIndex.build(data, page_size)
+  elif len(data) > index.csv_offset:
+    index.header, rows = parse_rows(data[index.csv_offset:], index.header)
+    for row in rows:
+      index.insert(row)
+  index.csv_offset, index.csv_sha256 = len(data), hashlib.sha256(data).hexdigest()
+  if not (PAGES_DIR / "meta.json").exists():
+    index.dirty = 0
 
-def read_rows():
-  if not CSV_PATH.exists():
-    return []
-  with CSV_PATH.open("r", encoding="utf-8") as f:
-    reader = csv.DictReader(f)
-    rows = [r for r in reader if (r.get("team") or "").strip()]
-  return rows
-
-def main():
-  rows = read_rows()
-  def score_key(r):
-    try:
-      return float(r.get("score","-inf"))
-    except:
-      return float("-inf")
-  def ts_key(r):
-    try:
-      return datetime.fromisoformat(r.get("timestamp_utc","").replace("Z","+00:00"))
-    except:
-      return datetime.fromtimestamp(0)
-
-  rows.sort(key=lambda r: (score_key(r), ts_key(r)), reverse=True)
-
-  lines = []
-  lines.append("# Leaderboard\n")
-  lines.append("This leaderboard is **auto-updated** when a submission PR is merged. ")
-  lines.append("For interactive search and filters, enable GitHub Pages and open **/docs/leaderboard.html**.\n\n")
-
-  lines.append("| Rank | Team | Model | Score | Date (UTC) | Notes |\n")
-  lines.append("|---:|---|---|---:|---|---|\n")
-  rank = 1
-  for i, r in enumerate(rows):
-    if i > 0:
-      prev_score = rows[i-1].get("score", "")
-      cur_score = r.get("score", "")
-      if cur_score != prev_score:
-        rank = i + 1
-    team = (r.get("team") or "").strip()
-    model = (r.get("model") or "").strip()
-    score = (r.get("score") or "").strip()
-    ts = (r.get("timestamp_utc") or "").strip()
-    notes = (r.get("notes") or "").strip()
-    model_disp = f"`{model}`" if model else ""
-    lines.append(f"| {rank} | {team} | {model_disp} | {score} | {ts} | {notes} |\n")
-
-  MD_PATH.write_text("".join(lines), encoding="utf-8")
+  write_markdown(index)
+  write_pages(index)
+  if CSV_PATH.exists():
+    shutil.copyfile(CSV_PATH, DOCS_CSV_PATH)
+  index.save()
 
 if __name__ == "__main__":
-  main()
+  import argparse
+  parser = argparse.ArgumentParser(description="Update the leaderboard index and render its outputs.")
+  parser.add_argument("--rebuild", action="store_true", help="re-read the whole CSV instead of only appended rows")
+  parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help="rows per JSON page (default: %(default)s)")
+  args = parser.parse_args()
+  main(args.rebuild, args.page_size)
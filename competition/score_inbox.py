@@ -0,0 +1,157 @@
+"""Decrypt, validate and score every submission in submissions/inbox/ at once.
+
+The test graph ids (and, when given, the private labels) are read once into
+a small manifest; workers get the manifest instead of re-reading the node
+CSV per submission. A failing submission is reported with the stage it
+failed at (decrypt, parse, validate, score) and does not stop the batch.
+"""
+import io
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "encryption"))
+from decrypt import decrypt_file
+from evaluate import align
+from metrics import macro_f1, auroc
+from validate_submission import validate
+
+_manifest = None  # per worker: graph ids and labels
+_private_key = None
+
+
+def build_manifest(test_path, label_path=None):
+    """graph_id (and label) of every test graph, one row per graph.
+
+    `test_path` is the node CSV (only its graph_id column is read) or a
+    manifest written earlier, whose labels are kept unless `label_path` is given.
+    """
+    header = pd.read_csv(test_path, nrows=0).columns
+    is_manifest = "node_id" not in header and "label" in header
+    manifest = pd.read_csv(test_path, usecols=["graph_id", "label"] if is_manifest else ["graph_id"])
+    manifest = manifest.drop_duplicates("graph_id").sort_values("graph_id").reset_index(drop=True)
+    if label_path:
+        labels = pd.read_csv(label_path, usecols=["graph_id", "label"]).drop_duplicates("graph_id")
+        manifest = manifest.drop(columns="label", errors="ignore").merge(labels, on="graph_id", how="left")
+        if manifest["label"].isna().any():
+            raise ValueError("Test graphs without a label: " + ", ".join(manifest.loc[manifest["label"].isna(), "graph_id"]))
+        manifest["label"] = manifest["label"].astype(int)
+    return manifest
+
+
+def find_submissions(inbox):
+    """(team, path) of every .enc file under inbox/<team>/, sorted by path."""
+    inbox = Path(inbox)
+    return [(path.relative_to(inbox).parts[0], path) for path in sorted(inbox.rglob("*.enc"))
+            if len(path.relative_to(inbox).parts) > 1]
+
+
+def _init_worker(manifest, private_key_pem):
+    global _manifest, _private_key
+    _manifest, _private_key = manifest, private_key_pem
+
+
+def score_submission(team, path):
+    """Result row of one submission; never raises."""
+    start = time.perf_counter()
+    result = {"team": team, "file": str(path), "status": "ok", "stage": "", "error": "",
+              "macro_f1": None, "auroc": None}
+    stage = "decrypt"
+    try:
+        data = decrypt_file(str(path), _private_key)
+        stage = "parse"
+        preds = pd.read_csv(io.BytesIO(data))
+        stage = "validate"
+        validate(preds, _manifest["graph_id"])
+        if "label" in _manifest.columns:
+            stage = "score"
+            merged = align(preds, _manifest)
+            result["macro_f1"] = macro_f1(merged["label_true"], merged["label_pred"])
+            result["auroc"] = auroc(merged["label_true"], merged["label_pred"])
+    except Exception as e:
+        result.update(status="error", stage=stage, error=str(e) if isinstance(e, ValueError) else f"{type(e).__name__}: {e}")
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def score_inbox(inbox, manifest, private_key_pem=None, workers=None, leaderboard=None):
+    """Score every submission in `inbox` against a build_manifest frame;
+    returns one result row per .enc file.
+
+    One submission per team: only a team's first .enc file (in path order)
+    is scored, later ones are rejected without being decrypted. With
+    `leaderboard` (a leaderboard CSV), teams already listed there are
+    rejected too, to score only new teams.
+    """
+    if private_key_pem is None:
+        private_key_pem = os.environ.get("SUBMISSION_PRIVATE_KEY", "")
+    if not private_key_pem.strip():
+        raise ValueError("No private key provided.")
+    submissions = find_submissions(inbox)
+    done = set()
+    if leaderboard and Path(leaderboard).exists():
+        done = set(pd.read_csv(leaderboard)["team"].astype(str).str.lower())
+
+    results, jobs, seen = [], [], set()
+    for team, path in submissions:
+        error = None
+        if team.lower() in done:
+            error = f"Team '{team}' is already on the leaderboard."
+        elif team.lower() in seen:
+            error = f"Team '{team}' has more than one submission; only the first is scored."
+        seen.add(team.lower())
+        if error:
+            results.append({"team": team, "file": str(path), "status": "error", "stage": "policy",
+                            "error": error, "macro_f1": None, "auroc": None, "seconds": 0.0})
+        else:
+            jobs.append((team, path))
+    if jobs:
+        workers = workers or min(len(jobs), os.cpu_count() or 1)
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(manifest, private_key_pem)) as pool:
+            results += pool.map(score_submission, *zip(*jobs), chunksize=max(1, len(jobs) // (4 * workers)))
+    return sorted(results, key=lambda r: r["file"])
+
+
+def main(inbox, test_path, label_path=None, out_path=None, workers=None, leaderboard=None, manifest_out=None):
+    start = time.perf_counter()
+    manifest = build_manifest(test_path, label_path)
+    if manifest_out:
+        manifest.to_csv(manifest_out, index=False)
+    results = score_inbox(inbox, manifest, workers=workers, leaderboard=leaderboard)
+    for r in results:
+        if r["status"] == "ok" and r["macro_f1"] is not None:
+            print(f"{r['team']}: MACRO_F1={r['macro_f1']:.6f} AUROC={r['auroc']:.6f}")
+        elif r["status"] == "ok":
+            print(f"{r['team']}: VALID SUBMISSION")
+        else:
+            print(f"{r['team']}: {r['stage']} failed: {r['error']}")
+    if out_path:
+        pd.DataFrame(results, columns=["team", "file", "status", "stage", "error", "macro_f1", "auroc",
+                                       "seconds"]).to_csv(out_path, index=False)
+    failed = sum(r["status"] != "ok" for r in results)
+    print(f"{len(results)} submissions, {failed} failed, in {time.perf_counter() - start:.1f}s")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Decrypt, validate and score all submissions in the inbox.")
+    parser.add_argument("--inbox", default="submissions/inbox")
+    parser.add_argument("--test", default="data/public/test_data.csv",
+                        help="test node CSV or a manifest with a graph_id column (default: data/public/test_data.csv)")
+    parser.add_argument("--labels", help="private test labels; without them submissions are only validated")
+    parser.add_argument("--out", help="write one result row per submission to this CSV")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--leaderboard",
+                        help="also reject teams already listed in this leaderboard CSV (to score only new teams)")
+    parser.add_argument("--write-manifest", metavar="PATH",
+                        help="also save the graph id / label manifest for reuse with --test")
+    args = parser.parse_args()
+    main(args.inbox, args.test, args.labels, args.out, args.workers, args.leaderboard, args.write_manifest)
@@ -1,10 +1,8 @@
 import pandas as pd
 import sys
 
-def main(pred_path, test_path):
-    preds = pd.read_csv(pred_path)
-    test = pd.read_csv(test_path)
-    
+def validate(preds, graph_ids):
+    """Raise ValueError unless `preds` is a valid submission for the test `graph_ids`."""
     if "graph_id" not in preds.columns or "label" not in preds.columns:
         raise ValueError("Must have graph_id and label columns")
     if preds["graph_id"].duplicated().any():
@@ -13,8 +11,13 @@ def main(pred_path, test_path):
         raise ValueError("NaN predictions found")
     if not preds["label"].isin([0,1]).all():
         raise ValueError("Predictions must be 0 or 1")
-    if set(preds["graph_id"]) != set(test["graph_id"].unique()):
+    if set(preds["graph_id"]) != set(graph_ids):
         raise ValueError("graph_id mismatch with test set")
+
+def main(pred_path, test_path):
+    preds = pd.read_csv(pred_path)
+    test = pd.read_csv(test_path, usecols=["graph_id"])
+    validate(preds, test["graph_id"].unique())
     print("VALID SUBMISSION")
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+"""Repeated stratified k-fold cross-validation of the GAT baseline.
+
+Folds are trained concurrently in a process pool. Each worker pins torch to
+a fixed number of intra-op threads so that workers * threads matches the
+cores available instead of every process grabbing all of them. Per-fold
+macro-F1 / AUROC come from competition/metrics.py and the best folds'
+weights are kept as checkpoints.
+"""
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+from sklearn.model_selection import StratifiedKFold
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'competition'))
+from metrics import auroc, macro_f1
+from baseline import DATA_TRACER, TRACERS, GrapeDataset, fit, infer, save_checkpoint
+
+DEFAULT_OUT_DIR = Path('checkpoints/cv')
+
+_graphs = None  # dataset loaded once per worker
+
+
+def fold_splits(labels, folds=5, seeds=(0,)):
+    """(seed, fold, train_idx, val_idx) for every fold of every repeat."""
+    splits = []
+    for seed in seeds:
+        skf = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+        for fold, (train_idx, val_idx) in enumerate(skf.split(np.zeros(len(labels)), labels)):
+            splits.append((seed, fold, train_idx, val_idx))
+    return splits
+
+
+def init_worker(graph_path, label_path, threads):
+    """Training-pool initializer (also used by sweep.py): pin torch to `threads`
+    intra-op threads and load the dataset once per worker; returns it."""
+    global _graphs
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    _graphs = GrapeDataset(graph_path, label_path)
+    return _graphs
+
+
+def _run_fold(split, params):
+    seed, fold, train_idx, val_idx = split
+    start = time.perf_counter()
+    model, val_acc = fit(_graphs, train_idx, val_idx, seed=seed * 1000 + fold, verbose=False, **params)
+    val_graphs = _graphs[torch.as_tensor(val_idx)]
+    _, probs, _ = infer(model, val_graphs)
+    y_true = np.array([int(g.y) for g in val_graphs])
+    return {
+        'seed': seed, 'fold': fold,
+        'macro_f1': macro_f1(y_true, probs.argmax(dim=1).numpy()),
+        'auroc': auroc(y_true, probs[:, 1].numpy()),
+        'val_acc': val_acc,
+        'seconds': time.perf_counter() - start,
+    }, model
+
+
+def cross_validate(graph_path='data/public/train_data.csv', label_path='data/public/train_labels.csv',
+                   folds=5, repeats=1, workers=None, threads=None, keep=3, out_dir=DEFAULT_OUT_DIR,
+                   tracer=DATA_TRACER, **params):
+    """Train folds x repeats models in parallel; `params` are passed to baseline.fit.
+
+    Returns a DataFrame with one row per fold. The `keep` best folds by
+    macro-F1 (then AUROC) are saved to out_dir as fold-s<seed>-k<fold>.pt,
+    recording `tracer`, the preprocess.py tracer the graphs were built with.
+    """
+    graphs = GrapeDataset(graph_path, label_path)  # builds the processed cache once so the spawned workers only read it
+    splits = fold_splits(np.array([int(g.y) for g in graphs]), folds, range(repeats))
+    cores = os.cpu_count() or 1
+    workers = workers or min(len(splits), cores)
+    threads = threads or max(1, cores // workers)
+    print(f"Cross-validating {folds} folds x {repeats} repeats: {workers} workers x {threads} threads")
+
+    results, models = [], {}
+    start = time.perf_counter()
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=init_worker,
+                             initargs=(str(graph_path), str(label_path), threads)) as pool:
+        futures = [pool.submit(_run_fold, split, params) for split in splits]
+        for future in futures:
+            row, model = future.result()
+            results.append(row)
+            models[row['seed'], row['fold']] = model
+            print(f"  seed {row['seed']} fold {row['fold']}: macro_f1={row['macro_f1']:.3f} "
+                  f"auroc={row['auroc']:.3f} ({row['seconds']:.1f}s)")
+
+    df = pd.DataFrame(results).sort_values(['macro_f1', 'auroc'], ascending=False, ignore_index=True)
+    out_dir = Path(out_dir)
+    for row in df.head(keep).itertuples():
+        save_checkpoint(models[row.seed, row.fold], out_dir / f"fold-s{row.seed}-k{row.fold}.pt",
+                        tracer, seed=row.seed, fold=row.fold, macro_f1=row.macro_f1, auroc=row.auroc)
+    if keep:
+        df.to_csv(out_dir / 'cv_results.csv', index=False)
+
+    print(f"macro_f1 = {df['macro_f1'].mean():.3f} +/- {df['macro_f1'].std(ddof=0):.3f}, "
+          f"auroc = {df['auroc'].mean():.3f} +/- {df['auroc'].std(ddof=0):.3f} "
+          f"over {len(df)} folds in {time.perf_counter() - start:.1f}s")
+    return df
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Repeated stratified k-fold CV of the GAT baseline.")
+    parser.add_argument('--graphs', default='data/public/train_data.csv',
+                        help="graph CSV or graph store directory (default: data/public/train_data.csv)")
+    parser.add_argument('--labels', default='data/public/train_labels.csv')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=1,
+                        help="number of differently seeded fold assignments (default: 1)")
+    parser.add_argument('--workers', type=int,
+                        help="number of folds trained at once (default: one per core, at most one per fold)")
+    parser.add_argument('--threads', type=int,
+                        help="torch intra-op threads per worker (default: cores / workers)")
+    parser.add_argument('--keep', type=int, default=3,
+                        help="number of best-fold checkpoints to save (default: 3)")
+    parser.add_argument('--out-dir', type=Path, default=DEFAULT_OUT_DIR)
+    parser.add_argument('--epochs', type=int, default=300)
+    parser.add_argument('--tracer', choices=TRACERS, default=DATA_TRACER,
+                        help="preprocess.py tracer the graphs were built with, recorded in the checkpoints (default: %(default)s)")
+    parser.add_argument('--augment', action='store_true',
+                        help="augment training batches (rotation, flip, jitter, width scaling, edge dropout)")
+    args = parser.parse_args()
+    cross_validate(args.graphs, args.labels, args.folds, args.repeats, args.workers, args.threads,
+                   args.keep, args.out_dir, args.tracer, epochs=args.epochs, augment=args.augment)
@@ -0,0 +1,185 @@
+"""Graph-level topological descriptors of vessel graphs.
+
+All descriptors of a whole dataset are computed in one vectorized pass over
+dataset-wide arrays: raw node features x (N, 4) with columns x, y, width,
+type (1 junction, 0 endpoint), per-graph node offsets node_ptr (G + 1),
+per-graph edge offsets edge_ptr (G + 1), and graph-local edges edge_index
+(2, E) listing both directions of every vessel segment.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components, dijkstra
+
+DESCRIPTOR_NAMES = [
+    # The original five baseline features, unchanged
+    'num_nodes', 'num_edges', 'avg_degree', 'junction_ratio', 'avg_width',
+    # Degree distribution
+    'max_degree', 'degree_0', 'degree_1', 'degree_2', 'degree_3', 'degree_4plus',
+    # Connectivity
+    'component_ratio', 'largest_component', 'cycle_rank',
+    # Branching order: hops from the widest node of each component
+    'branch_order_mean', 'branch_order_max',
+    # Edge (chord) length and vessel width distributions
+    'edge_length_mean', 'edge_length_std', 'edge_length_max',
+    'width_std', 'width_min', 'width_max',
+    # Box-counting dimension of the node cloud
+    'fractal_dim',
+]
+NUM_DESCRIPTORS = len(DESCRIPTOR_NAMES)
+
+BOX_SIZES = np.array([4, 8, 16, 32, 64])  # Box-counting scales in pixels
+
+CACHE_SIZE = 4096  # graphs whose descriptor rows are kept, least recently used evicted
+_cache = OrderedDict()  # per-graph digest -> descriptor row
+_cache_lock = threading.Lock()  # serve.py handler threads share the cache
+
+
+def _per_graph_mean(values, groups, counts):
+    return np.bincount(groups, weights=values, minlength=len(counts)) / np.maximum(counts, 1)
+
+
+def _per_graph_max(values, groups, n_graphs):
+    out = np.zeros(n_graphs)
+    np.maximum.at(out, groups, values)
+    return out
+
+
+def graph_descriptors(x, node_ptr, edge_ptr, edge_index):
+    """Descriptor matrix (G, NUM_DESCRIPTORS), columns named by DESCRIPTOR_NAMES."""
+    x = np.asarray(x, dtype=np.float64)
+    node_ptr = np.asarray(node_ptr, dtype=np.int64)
+    edge_ptr = np.asarray(edge_ptr, dtype=np.int64)
+    edge_index = np.asarray(edge_index, dtype=np.int64)
+    n_graphs = len(node_ptr) - 1
+    n_total = len(x)
+    nodes = np.diff(node_ptr).astype(np.float64)
+    edges = np.diff(edge_ptr).astype(np.float64)
+    node_graph = np.repeat(np.arange(n_graphs), np.diff(node_ptr))
+    edge_graph = np.repeat(np.arange(n_graphs), np.diff(edge_ptr))
+    src = edge_index[0] + node_ptr[edge_graph]
+    dst = edge_index[1] + node_ptr[edge_graph]
+
+    # Degrees and their histogram
+    degree = np.bincount(src, minlength=n_total).astype(np.float64)
+    avg_degree = _per_graph_mean(degree, node_graph, nodes)
+    max_degree = _per_graph_max(degree, node_graph, n_graphs)
+    bins = np.minimum(degree, 4).astype(np.int64)
+    hist = np.zeros((n_graphs, 5))
+    np.add.at(hist, (node_graph, bins), 1)
+    hist /= np.maximum(nodes, 1)[:, None]
+
+    junction_ratio = _per_graph_mean((x[:, 3] == 1).astype(np.float64), node_graph, nodes)
+    width = x[:, 2]
+    avg_width = _per_graph_mean(width, node_graph, nodes)
+    width_std = np.sqrt(np.maximum(_per_graph_mean(width**2, node_graph, nodes) - avg_width**2, 0))
+    width_max = _per_graph_max(width, node_graph, n_graphs)
+    width_min = -_per_graph_max(-width, node_graph, n_graphs)
+    width_min[nodes == 0] = 0
+
+    # Components and cycle rank over the block-diagonal dataset adjacency
+    adj = sparse.csr_matrix((np.ones(len(src)), (src, dst)), shape=(n_total, n_total))
+    n_comp, comp = connected_components(adj, directed=False)
+    comp_size = np.bincount(comp, minlength=n_comp)
+    comp_graph = np.zeros(n_comp, dtype=np.int64)
+    comp_graph[comp] = node_graph
+    components = np.bincount(comp_graph, minlength=n_graphs).astype(np.float64)
+    largest = _per_graph_max(comp_size.astype(np.float64), comp_graph, n_graphs)
+    undirected = src < dst
+    und_edges = np.bincount(edge_graph[undirected], minlength=n_graphs)
+    cycle_rank = np.maximum(und_edges - nodes + components, 0)
+
+    # Branching order: hop distance from the widest node of each component
+    by_comp = np.lexsort((-width, comp))
+    first = np.ones(n_total, dtype=bool)
+    first[1:] = comp[by_comp[1:]] != comp[by_comp[:-1]]
+    roots = by_comp[first]
+    if n_total:
+        order = dijkstra(adj, directed=False, indices=roots, unweighted=True, min_only=True)
+        order[~np.isfinite(order)] = 0
+    else:
+        order = np.zeros(0)
+    order_mean = _per_graph_mean(order, node_graph, nodes)
+    order_max = _per_graph_max(order, node_graph, n_graphs)
+
+    # Chord length of each undirected edge
+    length = np.hypot(x[src, 0] - x[dst, 0], x[src, 1] - x[dst, 1])[undirected]
+    length_graph = edge_graph[undirected]
+    length_mean = _per_graph_mean(length, length_graph, und_edges)
+    length_std = np.sqrt(np.maximum(_per_graph_mean(length**2, length_graph, und_edges) - length_mean**2, 0))
+    length_max = _per_graph_max(length, length_graph, n_graphs)
+
+    # Box counting: occupied boxes per scale, slope of log N vs log(1/s)
+    occupied = np.zeros((n_graphs, len(BOX_SIZES)))
+    for k, size in enumerate(BOX_SIZES):
+        bx = np.floor(x[:, 0] / size).astype(np.int64)
+        by = np.floor(x[:, 1] / size).astype(np.int64)
+        bx -= bx.min(initial=0)
+        by -= by.min(initial=0)
+        span_x, span_y = bx.max(initial=0) + 1, by.max(initial=0) + 1
+        boxes = np.unique((node_graph * span_x + bx) * span_y + by)
+        occupied[:, k] = np.bincount(boxes // (span_x * span_y), minlength=n_graphs)
+    log_s = np.log(1.0 / BOX_SIZES)
+    log_n = np.log(np.maximum(occupied, 1))
+    ds = log_s - log_s.mean()
+    fractal_dim = ((log_n - log_n.mean(axis=1, keepdims=True)) * ds).sum(axis=1) / (ds**2).sum()
+
+    safe_nodes = np.maximum(nodes, 1)
+    return np.column_stack([
+        nodes / 500, edges / 500, avg_degree / 5, junction_ratio, avg_width / 10,
+        max_degree / 5, hist,
+        components / safe_nodes, largest / safe_nodes, cycle_rank / safe_nodes,
+        order_mean / 10, order_max / 50,
+        length_mean / 50, length_std / 50, length_max / 50,
+        width_std / 10, width_min / 10, width_max / 10,
+        fractal_dim,
+    ]).astype(np.float32)
+
+
+def _graph_digest(x, edge_index):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.ascontiguousarray(x, dtype=np.float32).tobytes())
+    h.update(np.ascontiguousarray(edge_index, dtype=np.int64).tobytes())
+    return h.digest()
+
+
+def cached_descriptors(x, node_ptr, edge_ptr, edge_index):
+    """graph_descriptors with a per-graph LRU cache keyed by graph content.
+
+    Only graphs not seen recently are computed, still in a single vectorized
+    call over just those graphs. The cache holds at most CACHE_SIZE rows, so
+    long-lived processes (serve.py) do not grow with every new graph; it is
+    safe to call from several threads.
+    """
+    x = np.asarray(x)
+    edge_index = np.asarray(edge_index)
+    n_graphs = len(node_ptr) - 1
+    keys = [_graph_digest(x[node_ptr[g]:node_ptr[g + 1]], edge_index[:, edge_ptr[g]:edge_ptr[g + 1]])
+            for g in range(n_graphs)]
+    found = {}
+    with _cache_lock:
+        for key in keys:
+            if key in _cache:
+                _cache.move_to_end(key)
+                found[key] = _cache[key]
+    missing = [g for g, key in enumerate(keys) if key not in found]
+    if missing:
+        node_counts = np.diff(node_ptr)[missing]
+        edge_counts = np.diff(edge_ptr)[missing]
+        node_rows = np.concatenate([np.arange(node_ptr[g], node_ptr[g + 1]) for g in missing])
+        edge_cols = np.concatenate([np.arange(edge_ptr[g], edge_ptr[g + 1]) for g in missing])
+        rows = graph_descriptors(x[node_rows],
+                                 np.concatenate([[0], np.cumsum(node_counts)]),
+                                 np.concatenate([[0], np.cumsum(edge_counts)]),
+                                 edge_index[:, edge_cols])
+        with _cache_lock:
+            for g, row in zip(missing, rows):
+                found[keys[g]] = _cache[keys[g]] = row
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    if n_graphs == 0:
+        return np.zeros((0, NUM_DESCRIPTORS), dtype=np.float32)
+    return np.stack([found[key] for key in keys])
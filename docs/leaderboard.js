@@ -1,25 +1,3 @@
-function parseCSV(text){
-  const lines = text.trim().split(/\r?\n/);
-  const header = lines[0].split(",");
-  const rows = [];
-  for(let i=1;i<lines.length;i++){
-    if(!lines[i].trim()) continue;
-    const cols = [];
-    let cur="", inQ=false;
-    for(let j=0;j<lines[i].length;j++){
-      const ch = lines[i][j];
-      if(ch === '"'){ inQ = !inQ; continue; }
-      if(ch === "," && !inQ){ cols.push(cur); cur=""; continue; }
-      cur += ch;
-    }
-    cols.push(cur);
-    const obj = {};
-    header.forEach((h, idx) => obj[h] = (cols[idx] ?? "").trim());
-    rows.push(obj);
-  }
-  return rows;
-}
-
 function daysAgo(dateStr){
   const d = new Date(dateStr);
   if(isNaN(d.getTime())) return Infinity;
@@ -29,25 +7,23 @@ function daysAgo(dateStr){
 const state = {
   rows: [],
   filtered: [],
-  sortKey: "score",
-  sortDir: "desc",
+  sortKey: "rank",
+  sortDir: "asc",
   hiddenCols: new Set(),
+  total: 0,
+  pages: 0,
+  nextPage: 0,
+  loading: Promise.resolve(),
 };
 
 function renderTable(){
   const tbody = document.querySelector("#tbl tbody");
   tbody.innerHTML = "";
-  // Kaggle-style tied ranks: equal scores share the same rank
-  let rank = 1;
-  state.filtered.forEach((r, idx) => {
-    if(idx > 0){
-      const prevScore = parseFloat(state.filtered[idx - 1].score);
-      const curScore = parseFloat(r.score);
-      if(curScore !== prevScore) rank = idx + 1;
-    }
+  // Ranks come precomputed (tied scores share a rank) by competition/render_leaderboard.py
+  state.filtered.forEach(r => {
     const tr = document.createElement("tr");
     const cells = [
-      ["rank", rank],
+      ["rank", r.rank],
       ["team", r.team],
       ["model", r.model],
       ["score", r.score],
@@ -68,8 +44,16 @@ function renderTable(){
   document.querySelectorAll("#tbl thead th").forEach(th => {
     th.style.display = state.hiddenCols.has(th.dataset.key) ? "none" : "";
   });
+  const loaded = state.rows.length < state.total ? ` (${state.rows.length} of ${state.total} loaded)` : "";
   document.getElementById("status").textContent =
-    state.filtered.length ? `${state.filtered.length} result(s)` : "No results";
+    (state.filtered.length ? `${state.filtered.length} result(s)` : "No results") + loaded;
+  document.getElementById("more").hidden = state.nextPage >= state.pages;
+}
+
+function filtersActive(){
+  return document.getElementById("search").value.trim() !== ""
+    || document.getElementById("modelFilter").value !== "all"
+    || document.getElementById("dateFilter").value !== "all";
 }
 
 function applyFilters(){
@@ -89,6 +73,7 @@ function applyFilters(){
   const dir = state.sortDir === "asc" ? 1 : -1;
   rows.sort((a,b) => {
     let av = a[k], bv = b[k];
+    if(k === "rank") return (av - bv) * dir;
     if(k === "score"){
       av = parseFloat(av); bv = parseFloat(bv);
       if(isNaN(av)) av = -Infinity;
@@ -138,21 +123,52 @@ function setupSorting(){
   });
 }
 
+async function fetchJSON(path){
+  const res = await fetch(path, {cache:"no-store"});
+  if(!res.ok) throw new Error(`${path}: ${res.status}`);
+  return res.json();
+}
+
+// Pages are slices of the ranked leaderboard, fetched one at a time as needed.
+// Loads are queued so that concurrent requests never fetch a page twice.
+function loadPages(count){
+  state.loading = state.loading.catch(() => {}).then(async () => {
+    const first = state.nextPage, last = Math.min(state.pages, first + count);
+    if(first >= last) return;
+    const more = document.getElementById("more");
+    more.disabled = true;
+    try{
+      const pages = await Promise.all(
+        Array.from({length: last - first}, (_, i) => fetchJSON(`leaderboard/page-${first + i}.json`)));
+      pages.forEach(rows => state.rows.push(...rows));
+      state.nextPage = last;
+      applyFilters();
+    }finally{
+      more.disabled = false;
+    }
+  });
+  return state.loading;
+}
+
+// Search and filters must see the whole board, so they load the remaining pages
+function onFilterChange(){
+  applyFilters();
+  if(filtersActive() && state.nextPage < state.pages){
+    document.getElementById("status").textContent = `Loading all ${state.total} results…`;
+    loadPages(Infinity).catch(() => {
+      document.getElementById("status").textContent = "Failed to load the full leaderboard.";
+    });
+  }
+}
+
 async function main(){
   try{
-    const res = await fetch("leaderboard.csv", {cache:"no-store"});
-    const rows = parseCSV(await res.text()).filter(r => r.team).map(r => ({
-      timestamp_utc: r.timestamp_utc,
-      team: r.team,
-      model: (r.model || ""),
-      score: r.score,
-      notes: r.notes || "",
-    }));
-    state.rows = rows;
-
-    const modelSet = new Set(rows.map(r => r.model).filter(Boolean));
+    const meta = await fetchJSON("leaderboard/meta.json");
+    state.total = meta.total;
+    state.pages = meta.pages;
+
     const sel = document.getElementById("modelFilter");
-    [...modelSet].sort().forEach(m => {
+    meta.models.forEach(m => {
       const opt = document.createElement("option");
       opt.value = m; opt.textContent = m;
       sel.appendChild(opt);
@@ -160,10 +176,15 @@ async function main(){
 
     setupColumnToggles();
     setupSorting();
-    document.getElementById("search").addEventListener("input", applyFilters);
-    document.getElementById("modelFilter").addEventListener("change", applyFilters);
-    document.getElementById("dateFilter").addEventListener("change", applyFilters);
-    applyFilters();
+    document.getElementById("search").addEventListener("input", onFilterChange);
+    document.getElementById("modelFilter").addEventListener("change", onFilterChange);
+    document.getElementById("dateFilter").addEventListener("change", onFilterChange);
+    document.getElementById("more").addEventListener("click", () => {
+      loadPages(1).catch(() => {
+        document.getElementById("status").textContent = "Failed to load more results.";
+      });
+    });
+    await loadPages(1);
   }catch(e){
     document.getElementById("status").textContent = "Failed to load leaderboard.";
   }
@@ -1,34 +1,122 @@
-"""Decrypt a .enc submission using the private RSA key (hybrid RSA+Fernet)."""
+"""Decrypt .enc submissions using the private RSA key (hybrid RSA + AES-GCM).
+
+Reads the chunked format written by encrypt.py in constant memory, and the
+older single-token Fernet files (RSA-wrapped Fernet key + one token).
+"""
+import multiprocessing
 import os, sys
-from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.asymmetric import padding
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.fernet import Fernet
 
+from encrypt import HEADER, MAGIC, MAX_CHUNK_SIZE, OAEP, TAG_SIZE, chunk_nonce, read_full
+
 RSA_BLOCK = 256  # 2048-bit key
 
 
-def decrypt_file(enc_path: str, private_key_pem: str | None = None) -> bytes:
+def load_private_key(private_key_pem: str | None = None):
     if private_key_pem is None:
         private_key_pem = os.environ.get("SUBMISSION_PRIVATE_KEY", "")
     private_key_pem = private_key_pem.replace("\\n", "\n").strip()
     if not private_key_pem:
         raise ValueError("No private key provided.")
+    return serialization.load_pem_private_key(private_key_pem.encode(), password=None)
+
+
+def decrypt_stream(src, private_key):
+    """Yield the plaintext of the binary file object `src`, one chunk at a time.
+
+    Raises ValueError as soon as a chunk fails authentication, so callers
+    should discard what they received so far.
+    """
+    session_key = private_key.decrypt(read_full(src, RSA_BLOCK), OAEP)
+    header = read_full(src, HEADER.size)
+    if not header.startswith(MAGIC):
+        yield Fernet(session_key).decrypt(header + src.read())
+        return
+    if len(header) < HEADER.size or len(session_key) != 32:
+        raise ValueError("Malformed encrypted file header")
+    _, chunk_size, prefix = HEADER.unpack(header)
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"Unsupported chunk size {chunk_size}")
+
+    aead = AESGCM(session_key)
+    chunk, index = read_full(src, chunk_size + TAG_SIZE), 0
+    while True:
+        following = read_full(src, chunk_size + TAG_SIZE)
+        try:
+            plain = aead.decrypt(chunk_nonce(prefix, index, not following), chunk, header)
+        except InvalidTag:
+            raise ValueError(f"Chunk {index} failed authentication: file is corrupted or truncated") from None
+        yield plain
+        if not following:
+            return
+        chunk, index = following, index + 1
+
+
+def decrypt_file(enc_path: str, private_key_pem: str | None = None) -> bytes:
+    priv = load_private_key(private_key_pem)
+    with open(enc_path, "rb") as src:
+        return b"".join(decrypt_stream(src, priv))
+
+
+def decrypt_to_file(enc_path: str, out_path: str, private_key_pem: str | None = None):
+    """Stream-decrypt `enc_path` to `out_path`; nothing is left behind if it fails."""
+    priv = load_private_key(private_key_pem)
+    tmp = f"{out_path}.tmp"
+    try:
+        with open(enc_path, "rb") as src, open(tmp, "wb") as out:
+            for plain in decrypt_stream(src, priv):
+                out.write(plain)
+        os.replace(tmp, out_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return out_path
 
-    priv = serialization.load_pem_private_key(private_key_pem.encode(), password=None)
-    raw = open(enc_path, "rb").read()
 
-    session_key = priv.decrypt(
-        raw[:RSA_BLOCK],
-        padding.OAEP(mgf=padding.MGF1(hashes.SHA256()), algorithm=hashes.SHA256(), label=None),
-    )
-    return Fernet(session_key).decrypt(raw[RSA_BLOCK:])
+def _decrypt_one(enc_path, out_path, private_key_pem):
+    try:
+        return decrypt_to_file(enc_path, out_path, private_key_pem), None
+    except Exception as e:
+        return None, str(e) if isinstance(e, ValueError) else f"{type(e).__name__}: {e}"
+
+
+def decrypt_files(paths, out_dir: str | None = None, private_key_pem: str | None = None, workers: int | None = None):
+    """Decrypt many files in parallel processes, each to <out_dir or its own
+    directory>/<name without .enc>. Returns (output path or None, error or None)
+    per file; one bad file does not stop the others."""
+    if private_key_pem is None:
+        private_key_pem = os.environ.get("SUBMISSION_PRIVATE_KEY", "")
+    outs = [str(Path(out_dir or Path(p).parent) / Path(p).name.removesuffix(".enc")) for p in paths]
+    if out_dir:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+    workers = workers or min(len(outs), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(_decrypt_one, [str(p) for p in paths], outs, [private_key_pem] * len(outs)))
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python encryption/decrypt.py <file.enc> [output.csv]")
-        sys.exit(1)
-    data = decrypt_file(sys.argv[1])
-    out = sys.argv[2] if len(sys.argv) > 2 else sys.argv[1].replace(".enc", "")
-    open(out, "wb").write(data)
+    import argparse
+    parser = argparse.ArgumentParser(description="Decrypt submissions with SUBMISSION_PRIVATE_KEY.",
+                                     usage="%(prog)s <file.enc> [output.csv]\n"
+                                           "       %(prog)s --batch FILE [FILE ...] [--out-dir DIR] [--workers N]")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--batch", action="store_true", help="decrypt every given file, in parallel")
+    parser.add_argument("--out-dir", help="with --batch, write the decrypted files here")
+    parser.add_argument("--workers", type=int, help="with --batch, number of processes (default: one per core)")
+    args = parser.parse_args()
+    if args.batch:
+        failed = 0
+        for path, (out, error) in zip(args.paths, decrypt_files(args.paths, args.out_dir, workers=args.workers)):
+            print(f"Decrypted -> {out}" if out else f"{path}: {error}")
+            failed += out is None
+        sys.exit(1 if failed else 0)
+    if len(args.paths) > 2:
+        parser.error("give one input and an optional output, or use --batch")
+    out = args.paths[1] if len(args.paths) > 1 else args.paths[0].replace(".enc", "")
+    decrypt_to_file(args.paths[0], out)
     print(f"Decrypted -> {out}")
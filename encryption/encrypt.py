@@ -1,30 +1,105 @@
-"""Encrypt a submission CSV using the public RSA key (hybrid RSA+Fernet)."""
-import sys
+"""Encrypt submission files using the public RSA key (hybrid RSA + AES-GCM).
+
+Layout: the RSA-OAEP-wrapped AES-256 session key, a header (magic, chunk
+size, nonce prefix), then the data in fixed-size chunks, each sealed with
+AES-GCM on its own. A chunk's nonce holds its index and a last-chunk flag
+and the header is authenticated with every chunk, so reordered, dropped
+or truncated chunks fail to decrypt. Files of any size are encrypted in
+constant memory; decrypt.py also reads the older single-token Fernet files.
+"""
+import multiprocessing
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+KEY_PATH = Path(__file__).parent / "public_key.pem"
+MAGIC = b"GRAPEv2\x00"  # never the start of a Fernet token, which is base64 text
+HEADER = struct.Struct(">8sI7s")  # magic, chunk size, nonce prefix
+CHUNK_SIZE = 1 << 20
+MAX_CHUNK_SIZE = 1 << 26
+TAG_SIZE = 16
+OAEP = padding.OAEP(mgf=padding.MGF1(hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+
+
+def chunk_nonce(prefix: bytes, index: int, last: bool) -> bytes:
+    """96-bit nonce of chunk `index`: 7-byte file prefix, 4-byte index, last-chunk flag."""
+    if index >= 2**32:
+        raise ValueError("Too many chunks for one file")
+    return prefix + index.to_bytes(4, "big") + (b"\x01" if last else b"\x00")
+
 
+def read_full(src, size: int) -> bytes:
+    """Read `size` bytes, or fewer only at end of file (pipes may return short reads)."""
+    data = src.read(size)
+    while data and len(data) < size:
+        more = src.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
 
-def encrypt_file(csv_path: str, out_path: str | None = None):
-    key_path = Path(__file__).parent / "public_key.pem"
-    pub_key = serialization.load_pem_public_key(key_path.read_bytes())
 
-    session_key = Fernet.generate_key()
-    encrypted_data = Fernet(session_key).encrypt(Path(csv_path).read_bytes())
+def load_public_key(key_path=None):
+    return serialization.load_pem_public_key(Path(key_path or KEY_PATH).read_bytes())
 
-    encrypted_session_key = pub_key.encrypt(
-        session_key,
-        padding.OAEP(mgf=padding.MGF1(hashes.SHA256()), algorithm=hashes.SHA256(), label=None),
-    )
 
-    dest = Path(out_path) if out_path else Path(csv_path).with_suffix(".csv.enc")
-    dest.write_bytes(encrypted_session_key + encrypted_data)
+def encrypt_stream(src, public_key, chunk_size: int = CHUNK_SIZE):
+    """Yield the encrypted form of the binary file object `src`, one chunk at a time."""
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"chunk_size must be in 1..{MAX_CHUNK_SIZE}")
+    session_key = AESGCM.generate_key(bit_length=256)
+    header = HEADER.pack(MAGIC, chunk_size, os.urandom(7))
+    prefix = header[-7:]
+    yield public_key.encrypt(session_key, OAEP) + header
+
+    aead = AESGCM(session_key)
+    chunk, index = read_full(src, chunk_size), 0
+    while True:
+        following = read_full(src, chunk_size)
+        yield aead.encrypt(chunk_nonce(prefix, index, not following), chunk, header)
+        if not following:
+            return
+        chunk, index = following, index + 1
+
+
+def encrypt_file(csv_path: str, out_path: str | None = None, chunk_size: int = CHUNK_SIZE):
+    pub_key = load_public_key()
+    dest = Path(out_path) if out_path else Path(csv_path).with_suffix(Path(csv_path).suffix + ".enc")
+    with open(csv_path, "rb") as src, open(dest, "wb") as out:
+        for piece in encrypt_stream(src, pub_key, chunk_size):
+            out.write(piece)
     print(f"Encrypted -> {dest}")
+    return dest
+
+
+def encrypt_files(paths, out_dir: str | None = None, workers: int | None = None):
+    """Encrypt many files in parallel processes; each goes to <out_dir or its own
+    directory>/<name>.enc. Returns the written paths."""
+    dests = [Path(out_dir or Path(p).parent) / f"{Path(p).name}.enc" for p in paths]
+    if out_dir:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+    workers = workers or min(len(dests), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(encrypt_file, [str(p) for p in paths], [str(d) for d in dests]))
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python encryption/encrypt.py <predictions.csv> [output.enc]")
-        sys.exit(1)
-    encrypt_file(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    import argparse
+    parser = argparse.ArgumentParser(description="Encrypt a submission with the organizer's public key.",
+                                     usage="%(prog)s <predictions.csv> [output.enc]\n"
+                                           "       %(prog)s --batch FILE [FILE ...] [--out-dir DIR] [--workers N]")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--batch", action="store_true", help="encrypt every given file, in parallel")
+    parser.add_argument("--out-dir", help="with --batch, write the .enc files here")
+    parser.add_argument("--workers", type=int, help="with --batch, number of processes (default: one per core)")
+    args = parser.parse_args()
+    if args.batch:
+        encrypt_files(args.paths, args.out_dir, args.workers)
+    elif len(args.paths) > 2:
+        parser.error("give one input and an optional output, or use --batch")
+    else:
+        encrypt_file(args.paths[0], args.paths[1] if len(args.paths) > 1 else None)
@@ -0,0 +1,208 @@
+"""Score an ensemble of GrapeGAT checkpoints in one pass over the data.
+
+Member weights are stacked with torch.func.stack_module_state and the
+members are folded into the attention-head dimension of each GAT layer:
+every batch is collated once, each layer gathers its edge rows once for
+all members, and the readout MLPs run as batched matmuls. Plain
+vmap(functional_call) gives the same numbers but lowers the edge
+gathers and scatters to expanded gather / scatter_add, which is slower
+on CPU than looping over members. Members with differing architectures,
+or GAT layers configured unlike what the stacked forward reproduces, fall
+back to that loop over the same batches, and the first batch is scored
+both ways as a self-check.
+"""
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+from torch.func import stack_module_state
+from torch_geometric.nn import global_add_pool, global_max_pool, global_mean_pool
+from torch_geometric.utils import add_self_loops, remove_self_loops, softmax
+
+from baseline import DataLoader, GrapeDataset, load_checkpoint, node_budget_batches
+
+# GATConv settings and parameters that Ensemble._gat re-implements
+GAT_SETTINGS = {'negative_slope': 0.2, 'add_self_loops': True, 'fill_value': 'mean', 'concat': True, 'residual': False}
+GAT_DEFAULTS = {'residual': False}  # settings that older torch-geometric releases lack
+GAT_PARAMS = {'lin.weight', 'att_src', 'att_dst', 'bias'}
+GAT_EDGE_PARAMS = {'lin_edge.weight', 'att_edge'}
+SELF_CHECK_ATOL = 1e-4  # logits of the stacked and looped forward on the first batch
+
+
+def stackable(models):
+    """Whether the stacked forward reproduces every member: same config and
+    GAT layers with the settings and parameter names Ensemble._gat assumes."""
+    if len({repr(m.config) for m in models}) != 1:
+        return False
+    for model in models:
+        for conv in (model.conv1, model.conv2, model.conv3):
+            if any(getattr(conv, k, GAT_DEFAULTS.get(k)) != v for k, v in GAT_SETTINGS.items()):
+                return False
+            names = set(conv.state_dict())
+            if names != GAT_PARAMS | (GAT_EDGE_PARAMS if conv.edge_dim else set()):
+                return False
+    return True
+
+
+class Ensemble:
+    """Callable returning member logits (members, graphs, classes) for a batch."""
+    def __init__(self, models):
+        self.models = [m.eval() for m in models]
+        self.vectorized = stackable(self.models)
+        self._checked = False
+        if self.vectorized:
+            self.params, self.buffers = stack_module_state(self.models)
+            self.heads = [self.models[0].conv1.heads, self.models[0].conv2.heads, self.models[0].conv3.heads]
+    
+    def __len__(self):
+        return len(self.models)
+    
+    def _gat(self, name, heads, x, edge_index, edge_attr):
+        """GATConv of all members; x is (N, F) or (members, N, F), edges sorted by dst."""
+        p = self.params
+        weight = p[f'{name}.lin.weight']  # (M, H * C, F)
+        members, width = weight.shape[:2]
+        h = torch.matmul(x, weight.transpose(1, 2))  # (M, N, H * C)
+        n = h.shape[1]
+        h = h.view(members, n, heads, width // heads)
+        a_src = torch.einsum('mnhc,mhc->mnh', h, p[f'{name}.att_src'].squeeze(1))
+        a_dst = torch.einsum('mnhc,mhc->mnh', h, p[f'{name}.att_dst'].squeeze(1))
+        src, dst = edge_index
+        alpha = a_src.index_select(1, src) + a_dst.index_select(1, dst)
+        if edge_attr is not None:
+            # (edge_attr @ lin_edge^T) . att_edge, with the projection folded into att_edge first
+            lin_edge = p[f'{name}.lin_edge.weight'].view(members, heads, width // heads, -1)
+            att_edge = torch.einsum('mhcd,mhc->mhd', lin_edge, p[f'{name}.att_edge'].squeeze(1))
+            alpha = alpha + torch.einsum('ed,mhd->meh', edge_attr, att_edge)
+        alpha = F.leaky_relu(alpha, 0.2)
+        alpha = softmax(alpha, dst, num_nodes=n, dim=1)
+        
+        # Aggregate every (member, head) at once as one block-diagonal CSR
+        # matrix product instead of materialising per-edge messages
+        blocks = members * heads
+        ptr = F.pad(torch.bincount(dst, minlength=n).cumsum(0), (1, 0))
+        crow = torch.cat([(ptr[:-1] + torch.arange(blocks).unsqueeze(1) * len(src)).view(-1),
+                          ptr.new_tensor([blocks * len(src)])])
+        col = (src + torch.arange(blocks).unsqueeze(1) * n).view(-1)
+        adj = torch.sparse_csr_tensor(crow, col, alpha.transpose(1, 2).reshape(-1), (blocks * n, blocks * n),
+                                      check_invariants=False)
+        out = adj @ h.transpose(1, 2).reshape(blocks * n, -1)
+        return out.view(members, heads, n, -1).transpose(1, 2).reshape(members, n, width) + p[f'{name}.bias'].unsqueeze(1)
+    
+    def _bn(self, name, x):
+        p, b = self.params, self.buffers
+        scale = p[f'{name}.weight'] / torch.sqrt(b[f'{name}.running_var'] + self.models[0].bn1.eps)
+        return (x - b[f'{name}.running_mean'].unsqueeze(1)) * scale.unsqueeze(1) + p[f'{name}.bias'].unsqueeze(1)
+    
+    def _linear(self, name, x):
+        return torch.baddbmm(self.params[f'{name}.bias'].unsqueeze(1), x, self.params[f'{name}.weight'].transpose(1, 2))
+    
+    def _forward(self, data):
+        # Same computation as GrapeGAT.forward in eval mode, for all members at once
+        x, batch = data.x * self.buffers['node_scale'][0], data.batch
+        edge_attr = None
+        if self.models[0].config['edge_dim']:
+            edge_attr = data.edge_attr * self.buffers['edge_scale'][0]
+        edge_index, edge_attr = remove_self_loops(data.edge_index, edge_attr)
+        edge_index, edge_attr = add_self_loops(edge_index, edge_attr, fill_value='mean', num_nodes=len(x))
+        order = torch.argsort(edge_index[1], stable=True)
+        edge_index = edge_index[:, order]
+        edge_attr = edge_attr[order] if edge_attr is not None else None
+        for k, heads in enumerate(self.heads, 1):
+            x = F.elu(self._bn(f'bn{k}', self._gat(f'conv{k}', heads, x, edge_index, edge_attr)))
+        members, n, width = x.shape
+        flat = x.transpose(0, 1).reshape(n, members * width)
+        pooled = [pool(flat, batch).view(-1, members, width).transpose(0, 1)
+                  for pool in (global_mean_pool, global_max_pool, global_add_pool)]
+        graph_feats = data.graph_feats.expand(members, -1, -1)
+        x = F.elu(self._linear('fc1', torch.cat(pooled + [graph_feats], dim=-1)))
+        return self._linear('fc2', x)
+    
+    def _looped(self, batch):
+        return torch.stack([model(batch) for model in self.models])
+    
+    def __call__(self, batch):
+        if not self.vectorized:
+            return self._looped(batch)
+        logits = self._forward(batch)
+        if not self._checked:
+            self._checked = True
+            looped = self._looped(batch)
+            if not torch.allclose(logits, looped, atol=SELF_CHECK_ATOL):
+                warnings.warn("Stacked ensemble forward disagrees with the members' own forward; "
+                              "falling back to looping over members")
+                self.vectorized = False
+                return looped
+        return logits
+
+
+def ensemble_infer(models, graphs, max_nodes=20000, max_graphs=256):
+    """Mean class probabilities of all members and their disagreement.
+
+    Returns (gids, probs, disagreement, stats): probs (G, classes) is the
+    member average and disagreement (G,) the standard deviation of the
+    members' class-1 probability; stats has the same fields as baseline.infer.
+    All members' activations are live at once, so `max_nodes` caps nodes
+    times members per batch to keep peak memory in line with baseline.infer.
+    """
+    ensemble = models if isinstance(models, Ensemble) else Ensemble(models)
+    budget = max(1, max_nodes // len(ensemble))
+    batches = node_budget_batches([g.num_nodes for g in graphs], budget, max_graphs)
+    loader = DataLoader(graphs, batch_sampler=batches)
+
+    gids, probs, spread, latencies = [], [], [], []
+    start = time.perf_counter()
+    with torch.no_grad():
+        for batch in loader:
+            t0 = time.perf_counter()
+            member_probs = F.softmax(ensemble(batch), dim=-1)
+            probs.append(member_probs.mean(dim=0))
+            spread.append(member_probs[..., 1].std(dim=0, unbiased=False))
+            latencies.append(time.perf_counter() - t0)
+            gids.extend(batch.gid)
+    elapsed = time.perf_counter() - start
+
+    stats = {
+        'members': len(ensemble),
+        'vectorized': ensemble.vectorized,
+        'graphs': len(gids),
+        'batches': len(latencies),
+        'graphs_per_sec': len(gids) / elapsed if elapsed > 0 else float('inf'),
+        'p50_ms': float(np.percentile(latencies, 50)) * 1000 if latencies else 0.0,
+        'p99_ms': float(np.percentile(latencies, 99)) * 1000 if latencies else 0.0,
+    }
+    if not probs:
+        return gids, torch.zeros(0, 2), torch.zeros(0), stats
+    return gids, torch.cat(probs), torch.cat(spread), stats
+
+
+def predict_ensemble(checkpoints, graph_path, out_path, details_path=None, max_nodes=20000):
+    """Write the ensemble's submission CSV, and optionally per-graph probability
+    and disagreement to details_path."""
+    models = [load_checkpoint(path)[0] for path in checkpoints]
+    gids, probs, disagreement, stats = ensemble_infer(models, GrapeDataset(graph_path), max_nodes=max_nodes)
+    labels = probs.argmax(dim=1).tolist()
+    pd.DataFrame({'graph_id': gids, 'label': labels}).to_csv(out_path, index=False)
+    print(f"Saved predictions of {stats['members']} members to {out_path}")
+    if details_path:
+        pd.DataFrame({'graph_id': gids, 'label': labels, 'prob': probs[:, 1].tolist(),
+                      'disagreement': disagreement.tolist()}).to_csv(details_path, index=False)
+    print(f"Inference: {stats['graphs']} graphs in {stats['batches']} batches "
+          f"({'stacked' if stats['vectorized'] else 'looped'} members), {stats['graphs_per_sec']:.1f} graphs/s, "
+          f"p50={stats['p50_ms']:.1f}ms, p99={stats['p99_ms']:.1f}ms")
+    print(f"Mean disagreement: {disagreement.mean().item():.3f}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Predict with an ensemble of GrapeGAT checkpoints.")
+    parser.add_argument('graphs', help="graph CSV or graph store directory to score")
+    parser.add_argument('out', help="submission CSV to write")
+    parser.add_argument('checkpoints', nargs='+', help="checkpoints written by cv.py / baseline.save_checkpoint")
+    parser.add_argument('--details', help="also write per-graph probability and member disagreement here")
+    parser.add_argument('--max-nodes', type=int, default=20000, help="node budget per batch (default: 20000)")
+    args = parser.parse_args()
+    predict_ensemble(args.checkpoints, args.graphs, args.out, args.details, args.max_nodes)
@@ -1,62 +1,139 @@
 import cv2
+import hashlib
+import json
+import os
+import time
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 from skimage.morphology import skeletonize
-from scipy import ndimage
+from scipy import ndimage, sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+import profiling
 
 TARGET_SIZE = 600  # Resize large images to this max dimension
+MERGE_THRESH = 15  # Keypoints closer than this (px) collapse into one node
+EDGE_RADIUS = 80  # BFS tracer only: max node distance (px) to try tracing
+MAX_TRACE_STEPS = 500  # BFS tracer only: max pixels visited per trace
+MIN_EDGE_LENGTH = 5  # Drop edges whose pixel length is not above this
+TRACERS = ('segments', 'bfs')
+TILE_HALO = 32  # Native mode: context (px) around each tile, must exceed the widest vessel
+TILE_BYTES_PER_PIXEL = 48  # Native mode: rough peak working memory per tile pixel
+DEFAULT_MEMORY_MB = 512  # Native mode: default working-memory budget
+CACHE_VERSION = 3  # Bump whenever extraction code changes the graphs it produces
+DEFAULT_CACHE_DIR = Path(__file__).parent / 'data' / 'cache' / 'graphs'
+# Per-edge attribute columns of graph_rows, each aligned with `edges`
+EDGE_ATTR_COLUMNS = ('edge_length', 'edge_tortuosity', 'edge_mean_width', 'edge_min_width')
 
+@profiling.timed()
 def load_mask(path, resize=True):
     """Load vessel segmentation mask from various formats."""
     path = str(path)
     img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
     if img is None:
         raise ValueError(f"Cannot load: {path}")
+    return _binarize(img, resize)
+
+@profiling.timed('load_mask')
+def decode_mask(data, resize=True):
+    """load_mask for the bytes of an encoded image file."""
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError("Cannot decode mask image")
+    return _binarize(img, resize)
+
+def _binarize(img, resize):
     # Resize if too large
     if resize and max(img.shape) > TARGET_SIZE:
         scale = TARGET_SIZE / max(img.shape)
         img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
     return (img > 127).astype(np.uint8)
 
-def get_neighbors(skel, y, x):
-    h, w = skel.shape
-    count = 0
-    for dy in [-1, 0, 1]:
-        for dx in [-1, 0, 1]:
-            if dy == 0 and dx == 0: continue
-            ny, nx = y + dy, x + dx
-            if 0 <= ny < h and 0 <= nx < w and skel[ny, nx]:
-                count += 1
-    return count
+# 8-neighbourhood of a skeleton pixel, centre excluded
+NEIGHBOR_KERNEL = np.array([[1, 1, 1],
+                            [1, 0, 1],
+                            [1, 1, 1]], dtype=np.uint8)
 
+def count_neighbors(skel):
+    """Number of 8-connected skeleton neighbours of every pixel (0 outside the image)."""
+    skel = (skel > 0).astype(np.uint8)
+    return ndimage.convolve(skel, NEIGHBOR_KERNEL, mode='constant', cval=0)
+
+@profiling.timed()
 def find_keypoints(skel):
-    h, w = skel.shape
-    endpoints, junctions = [], []
-    for y in range(1, h-1):
-        for x in range(1, w-1):
-            if not skel[y, x]: continue
-            n = get_neighbors(skel, y, x)
-            if n == 1: endpoints.append((y, x))
-            elif n >= 3: junctions.append((y, x))
+    """Endpoint and junction coordinates of a skeleton as (K, 2) arrays of (y, x).
+
+    Endpoints have exactly one neighbour, junctions three or more. The one-pixel
+    image border is ignored and points are returned in row-major order.
+    """
+    skel = skel > 0
+    counts = count_neighbors(skel)
+    interior = np.zeros_like(skel)
+    interior[1:-1, 1:-1] = True
+    on = skel & interior
+    endpoints = np.argwhere(on & (counts == 1))
+    junctions = np.argwhere(on & (counts >= 3))
     return endpoints, junctions
 
-def merge_close(points, thresh=10):
-    if not points: return []
-    merged, used = [], set()
-    for i, p1 in enumerate(points):
-        if i in used: continue
-        cluster = [p1]
-        used.add(i)
-        for j, p2 in enumerate(points):
-            if j in used: continue
-            if np.sqrt((p1[0]-p2[0])**2 + (p1[1]-p2[1])**2) < thresh:
-                cluster.append(p2)
-                used.add(j)
-        merged.append((np.mean([p[0] for p in cluster]), np.mean([p[1] for p in cluster])))
-    return merged
-
-def trace_edge(skel, start, end, max_steps=500):
+def _radius_query(radius):
+    # KD-tree ball queries include the boundary and round differently from the
+    # explicit distance below; query slightly wider and filter exactly.
+    return radius * (1 + 1e-9) + 1e-9
+
+def radius_pairs(points, radius):
+    """Index pairs (i, j), i < j, of points closer than `radius`, in lexicographic order.
+
+    Candidate pairs come from a KD-tree, so the cost grows with the number of
+    close pairs rather than with N^2.
+    """
+    pts = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(pts) < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    pairs = cKDTree(pts).query_pairs(_radius_query(radius), output_type='ndarray')
+    d = np.sqrt(((pts[pairs[:, 0]] - pts[pairs[:, 1]])**2).sum(axis=1))
+    pairs = pairs[d < radius]
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+@profiling.timed()
+def cluster_close(points, thresh=10):
+    """Greedy radius clustering of points; returns one cluster label per point.
+
+    Points are visited in order and each unassigned point seeds a cluster of all
+    unassigned points closer than `thresh` to it.
+    """
+    pts = np.asarray(points, dtype=float).reshape(-1, 2)
+    labels = np.full(len(pts), -1, dtype=np.int64)
+    if len(pts) == 0:
+        return labels
+    neighbors = cKDTree(pts).query_ball_point(pts, _radius_query(thresh), return_sorted=True)
+    n_clusters = 0
+    for i in range(len(pts)):
+        if labels[i] >= 0: continue
+        cand = np.asarray(neighbors[i], dtype=np.int64)
+        cand = cand[labels[cand] < 0]
+        d = np.sqrt(((pts[cand] - pts[i])**2).sum(axis=1))
+        labels[cand[d < thresh]] = n_clusters
+        labels[i] = n_clusters
+        n_clusters += 1
+    return labels
+
+@profiling.timed()
+def merge_close(points, thresh=10, labels=None):
+    """Centroids of the clusters found by cluster_close, in cluster order."""
+    if len(points) == 0: return []
+    if labels is None:
+        labels = cluster_close(points, thresh)
+    points = np.asarray(points)
+    order = np.argsort(labels, kind='stable')
+    sizes = np.bincount(labels)
+    clusters = np.split(points[order], np.cumsum(sizes)[:-1])
+    return [(np.mean(c[:, 0]), np.mean(c[:, 1])) for c in clusters]
+
+def trace_edge(skel, start, end, max_steps=MAX_TRACE_STEPS):
     from collections import deque
     h, w = skel.shape
     visited = set([start])
@@ -74,55 +151,496 @@ def trace_edge(skel, start, end, max_steps=500):
                     queue.append(((ny, nx), path + [(ny, nx)]))
     return None
 
-def estimate_width(mask, skel, y, x):
-    dist = ndimage.distance_transform_edt(mask)
-    if 0 <= int(y) < dist.shape[0] and 0 <= int(x) < dist.shape[1]:
-        return float(dist[int(y), int(x)] * 2)
-    return 3.0
-
-def mask_to_graph(mask_path, graph_id):
-    mask = load_mask(mask_path)
-    skel = skeletonize(mask > 0).astype(np.uint8)
-    
-    endpoints, junctions = find_keypoints(skel)
-    endpoints = merge_close(endpoints, 15)
-    junctions = merge_close(junctions, 15)
-    
-    nodes = []
-    for i, (y, x) in enumerate(junctions):
-        nodes.append({'id': i, 'y': y, 'x': x, 'type': 1, 'width': estimate_width(mask, skel, y, x)})
-    offset = len(junctions)
-    for i, (y, x) in enumerate(endpoints):
-        nodes.append({'id': offset+i, 'y': y, 'x': x, 'type': 0, 'width': estimate_width(mask, skel, y, x)})
-    
-    edges = []
-    for i, n1 in enumerate(nodes):
-        for j, n2 in enumerate(nodes):
-            if i >= j: continue
-            dist = np.sqrt((n1['y']-n2['y'])**2 + (n1['x']-n2['x'])**2)
-            if dist < 80:
+@profiling.timed()
+def distance_map(mask):
+    """Distance from every vessel pixel to the background. Compute once per mask."""
+    return ndimage.distance_transform_edt(mask)
+
+@profiling.timed()
+def estimate_width(dist_map, ys, xs):
+    """Vessel width (twice the distance to background) at one or many points.
+
+    Sub-pixel coordinates are bilinearly interpolated; points outside the image
+    get a default width of 3.0. Returns an array shaped like the broadcast inputs.
+    """
+    ys, xs = np.broadcast_arrays(np.asarray(ys, dtype=float), np.asarray(xs, dtype=float))
+    h, w = dist_map.shape
+    widths = 2 * ndimage.map_coordinates(dist_map, [ys.ravel(), xs.ravel()], order=1, mode='nearest')
+    inside = (ys.ravel() >= 0) & (ys.ravel() <= h - 1) & (xs.ravel() >= 0) & (xs.ravel() <= w - 1)
+    return np.where(inside, widths, 3.0).reshape(ys.shape)
+
+def path_arc_lengths(paths):
+    """Arc length of each [(y, x), ...] pixel path: 1 per axial and sqrt(2) per diagonal step."""
+    return np.array([np.hypot(*np.diff(np.asarray(p, dtype=float).reshape(-1, 2), axis=0).T).sum()
+                     for p in paths])
+
+def skeleton_links(seg):
+    """Per-pixel arc contributions of an 8-connected labelled skeleton.
+
+    Yields (labels, step) pairs: the label of each linked pixel pair and the
+    step length. Diagonal links are skipped where an axial path through a
+    corner pixel exists (m-adjacency), so staircases are not double counted.
+    """
+    on = seg > 0
+    yield seg[:, :-1][on[:, :-1] & on[:, 1:]], 1.0
+    yield seg[:-1][on[:-1] & on[1:]], 1.0
+    corners = ~on[:-1, 1:] & ~on[1:, :-1]
+    yield seg[:-1, :-1][on[:-1, :-1] & on[1:, 1:] & corners], np.sqrt(2)
+    corners = ~on[:-1, :-1] & ~on[1:, 1:]
+    yield seg[:-1, 1:][on[:-1, 1:] & on[1:, :-1] & corners], np.sqrt(2)
+
+def tortuosity(points, i, j, arc):
+    """Arc / chord ratio of edges between nodes i and j, at least 1; chords
+    shorter than a pixel count as one pixel."""
+    chord = np.hypot(*(points[i] - points[j]).T) if len(arc) else np.zeros(0)
+    return np.maximum(np.asarray(arc) / np.maximum(chord, 1.0), 1.0)
+
+def path_widths(dist_map, paths):
+    """Mean and min width along each traced path, sampled in one lookup.
+
+    `paths` is a sequence of non-empty [(y, x), ...] pixel paths. Returns two
+    arrays of length len(paths).
+    """
+    if len(paths) == 0:
+        return np.zeros(0), np.zeros(0)
+    lengths = np.array([len(p) for p in paths])
+    coords = np.concatenate([np.asarray(p, dtype=float).reshape(-1, 2) for p in paths])
+    profile = estimate_width(dist_map, coords[:, 0], coords[:, 1])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    return np.add.reduceat(profile, starts) / lengths, np.minimum.reduceat(profile, starts)
+
+def _segment_stats(seg, n_seg, node_img, width_img):
+    """Per-segment pixel count, width sum, width min and arc length, plus
+    (segment, node) contacts.
+
+    `seg` labels segments 1..n_seg (0 elsewhere). `node_img` holds the node id
+    of every keypoint pixel (-1 elsewhere) and is padded by one pixel on each
+    side of `seg`, so keypoints just outside the labelled window still count.
+    """
+    h, w = seg.shape
+    contacts = [np.zeros((0, 2), dtype=np.int64)]
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dy == 0 and dx == 0: continue
+            nbr = node_img[1+dy:h+1+dy, 1+dx:w+1+dx]
+            hit = (seg > 0) & (nbr >= 0)
+            contacts.append(np.stack([seg[hit], nbr[hit]], axis=1).astype(np.int64))
+    contacts = np.unique(np.concatenate(contacts), axis=0)
+    
+    on = seg > 0
+    labels, widths = seg[on], width_img[on]
+    sizes = np.bincount(labels, minlength=n_seg + 1)
+    width_sum = np.bincount(labels, weights=widths, minlength=n_seg + 1)
+    width_min = np.full(n_seg + 1, np.inf)
+    np.minimum.at(width_min, labels, widths)
+    arc = np.zeros(n_seg + 1)
+    for link_labels, step in skeleton_links(seg):
+        arc += step * np.bincount(link_labels, minlength=n_seg + 1)
+    return sizes, width_sum, width_min, arc, contacts
+
+def _join_segments(sizes, width_sum, width_min, arc, contacts):
+    """Edges from per-segment stats and contacts; see trace_segments."""
+    if len(contacts) == 0:
+        return []
+    best = {}
+    seg_ids, starts = np.unique(contacts[:, 0], return_index=True)
+    stops = np.append(starts[1:], len(contacts))
+    for sid, a0, a1 in zip(seg_ids, starts, stops):
+        touched = contacts[a0:a1, 1]
+        edge = (int(sizes[sid]) + 2, width_sum[sid] / sizes[sid], width_min[sid], arc[sid] + 2)
+        for a in range(len(touched)):
+            for b in range(a + 1, len(touched)):
+                pair = (int(touched[a]), int(touched[b]))
+                if pair not in best or edge[0] < best[pair][0]:
+                    best[pair] = edge
+    return [(i, j, length, float(mw), float(lw), float(a)) for (i, j), (length, mw, lw, a) in sorted(best.items())]
+
+@profiling.timed('trace_edges')
+def trace_segments(skel, keypoints, node_ids, dist_map):
+    """Edges of the skeleton graph from a single connected-component pass.
+
+    Keypoint pixels are cut out of the skeleton so that every remaining
+    8-connected component is one vessel segment. Each segment is joined to the
+    nodes (`node_ids`, one per keypoint) of the keypoints it touches. Segments
+    touching fewer than two distinct nodes are dropped; when several segments
+    join the same node pair the shortest one is kept.
+
+    Returns a list of (i, j, length, mean_width, min_width, arc) with i < j,
+    sorted by (i, j), where `length` counts the segment pixels plus its two
+    end keypoints, widths are sampled at the segment pixels and `arc` is the
+    segment's skeleton_links length plus one step to each end keypoint.
+    """
+    h, w = skel.shape
+    node_img = np.full((h + 2, w + 2), -1, dtype=np.int64)
+    if len(keypoints):
+        node_img[keypoints[:, 0] + 1, keypoints[:, 1] + 1] = node_ids
+    body = (skel > 0) & (node_img[1:-1, 1:-1] < 0)
+    seg, n_seg = ndimage.label(body, structure=np.ones((3, 3), dtype=int))
+    return _join_segments(*_segment_stats(seg, n_seg, node_img, 2 * dist_map))
+
+def _keypoint_nodes(raw_endpoints, raw_junctions):
+    """Merge raw keypoints into nodes, junctions first.
+
+    Returns (points, types, keypoints, node_ids): node centroids (N, 2), node
+    types (1 junction, 0 endpoint), all raw keypoints and the node of each.
+    """
+    endpoint_labels = cluster_close(raw_endpoints, MERGE_THRESH)
+    junction_labels = cluster_close(raw_junctions, MERGE_THRESH)
+    endpoints = merge_close(raw_endpoints, labels=endpoint_labels)
+    junctions = merge_close(raw_junctions, labels=junction_labels)
+    points = np.array(junctions + endpoints, dtype=float).reshape(-1, 2)
+    types = np.array([1] * len(junctions) + [0] * len(endpoints), dtype=np.int64)
+    keypoints = np.concatenate([raw_junctions, raw_endpoints]).reshape(-1, 2)
+    node_ids = np.concatenate([junction_labels, endpoint_labels + len(junctions)])
+    return points, types, keypoints, node_ids
+
+def with_tortuosity(points, edges):
+    """Replace the arc length closing each (i, j, length, mean_width, min_width,
+    arc) edge with its tortuosity against the chord between node centroids."""
+    if not edges:
+        return []
+    i, j = np.array([e[0] for e in edges]), np.array([e[1] for e in edges])
+    tort = tortuosity(points, i, j, [e[5] for e in edges])
+    return [(*e[:5], float(t)) for e, t in zip(edges, tort)]
+
+def _graph_nodes(points, types, widths):
+    return [{'id': i, 'y': float(y), 'x': float(x), 'type': int(t), 'width': float(wd)}
+            for i, ((y, x), t, wd) in enumerate(zip(points, types, widths))]
+
+def extract_graph(mask, tracer='segments'):
+    """Vessel graph of a binary mask.
+
+    Returns (nodes, edges): nodes are dicts with id, y, x, type (1 junction,
+    0 endpoint) and width; edges are (i, j, length, mean_width, min_width,
+    tortuosity), see with_tortuosity.
+    `tracer` picks the edge extractor: 'segments' labels the skeleton once
+    (trace_segments), 'bfs' runs the legacy pairwise trace_edge search.
+    """
+    if tracer not in TRACERS:
+        raise ValueError(f"Unknown tracer: {tracer}")
+    with profiling.timer('skeletonize'):
+        skel = skeletonize(mask > 0).astype(np.uint8)
+    points, types, keypoints, node_ids = _keypoint_nodes(*find_keypoints(skel))
+    
+    dist_map = distance_map(mask)
+    widths = estimate_width(dist_map, points[:, 0], points[:, 1])
+    nodes = _graph_nodes(points, types, widths)
+    
+    if tracer == 'segments':
+        edges = trace_segments(skel, keypoints, node_ids, dist_map)
+    else:
+        edges, paths = [], []
+        with profiling.timer('trace_edges'):
+            for i, j in radius_pairs(points, EDGE_RADIUS):
+                n1, n2 = nodes[i], nodes[j]
                 path = trace_edge(skel, (int(n1['y']), int(n1['x'])), (int(n2['y']), int(n2['x'])))
-                if path and len(path) > 5:
-                    edges.append((i, j, len(path)))
+                if path:
+                    edges.append((int(i), int(j), len(path)))
+                    paths.append(path)
+        mean_widths, min_widths = path_widths(dist_map, paths)
+        edges = [(i, j, n, float(mw), float(lw), float(a)) for (i, j, n), mw, lw, a
+                 in zip(edges, mean_widths, min_widths, path_arc_lengths(paths))]
+    return nodes, with_tortuosity(points, [e for e in edges if e[2] > MIN_EDGE_LENGTH])
+
+def tile_bounds(shape, memory_mb=DEFAULT_MEMORY_MB, halo=TILE_HALO):
+    """Row and column boundaries of the tiles used by extract_graph_tiled.
+
+    The whole-image mask and skeleton (one byte per pixel each) are charged to
+    the budget first; tiles are then sized so that one tile plus its halo fits
+    in what is left.
+    """
+    h, w = shape
+    budget = memory_mb * 2**20 - 2 * h * w
+    side = int(np.sqrt(max(budget, 0) / TILE_BYTES_PER_PIXEL)) - 2 * halo
+    if side < 64:
+        raise ValueError(f"Memory budget of {memory_mb} MB is too small for a {h}x{w} mask")
+    return list(range(0, h, side)) + [h], list(range(0, w, side)) + [w]
+
+def extract_graph_tiled(mask, memory_mb=DEFAULT_MEMORY_MB, halo=TILE_HALO):
+    """Segment-tracer vessel graph of a full-resolution mask, built tile by tile.
+
+    Skeletonization and distance transforms run on tiles with a `halo` of
+    context, keypoints and vessel segments are found per tile, and segments
+    cut by tile seams are joined again before edges are formed. Peak working
+    memory stays within roughly `memory_mb`. Returns (nodes, edges) like
+    extract_graph.
+    """
+    h, w = mask.shape
+    ybounds, xbounds = tile_bounds(mask.shape, memory_mb, halo)
+    tiles = [(y0, y1, x0, x1) for y0, y1 in zip(ybounds[:-1], ybounds[1:])
+             for x0, x1 in zip(xbounds[:-1], xbounds[1:])]
+    
+    def window(y0, y1, x0, x1, pad):
+        return max(y0 - pad, 0), min(y1 + pad, h), max(x0 - pad, 0), min(x1 + pad, w)
+    
+    # Pass 1: skeleton, thinned with enough context that seams do not matter
+    skel = np.zeros((h, w), dtype=bool)
+    for y0, y1, x0, x1 in tiles:
+        wy0, wy1, wx0, wx1 = window(y0, y1, x0, x1, halo)
+        with profiling.timer('skeletonize'):
+            tile_skel = skeletonize(mask[wy0:wy1, wx0:wx1] > 0)
+        skel[y0:y1, x0:x1] = tile_skel[y0-wy0:y1-wy0, x0-wx0:x1-wx0]
+    
+    # Pass 2: keypoints; neighbour counts only need a one-pixel halo
+    found_endpoints, found_junctions = [], []
+    with profiling.timer('find_keypoints'):
+        for y0, y1, x0, x1 in tiles:
+            wy0, wy1, wx0, wx1 = window(y0, y1, x0, x1, 1)
+            counts = count_neighbors(skel[wy0:wy1, wx0:wx1])[y0-wy0:y1-wy0, x0-wx0:x1-wx0]
+            on = skel[y0:y1, x0:x1].copy()
+            if y0 == 0: on[0, :] = False
+            if y1 == h: on[-1, :] = False
+            if x0 == 0: on[:, 0] = False
+            if x1 == w: on[:, -1] = False
+            found_endpoints.append(np.argwhere(on & (counts == 1)) + (y0, x0))
+            found_junctions.append(np.argwhere(on & (counts >= 3)) + (y0, x0))
+    raw_endpoints, raw_junctions = np.concatenate(found_endpoints), np.concatenate(found_junctions)
+    # Back to the row-major order find_keypoints produces for a whole image
+    raw_endpoints = raw_endpoints[np.lexsort((raw_endpoints[:, 1], raw_endpoints[:, 0]))]
+    raw_junctions = raw_junctions[np.lexsort((raw_junctions[:, 1], raw_junctions[:, 0]))]
+    points, types, keypoints, node_ids = _keypoint_nodes(raw_endpoints, raw_junctions)
+    
+    # Pass 3: node widths and vessel segments per tile, recording segment
+    # labels on both sides of every seam so cut segments can be rejoined
+    widths = np.full(len(points), 3.0)
+    row_seams = {y: (np.zeros(w, dtype=np.int64), np.zeros(w, dtype=np.int64)) for y in ybounds[1:-1]}
+    col_seams = {x: (np.zeros(h, dtype=np.int64), np.zeros(h, dtype=np.int64)) for x in xbounds[1:-1]}
+    seg_stats, seg_contacts, n_total = [], [], 0
+    for y0, y1, x0, x1 in tiles:
+        wy0, wy1, wx0, wx1 = window(y0, y1, x0, x1, halo)
+        dist_win = distance_map(mask[wy0:wy1, wx0:wx1])
+        inside = ((points[:, 0] >= y0) & (points[:, 0] < y1) &
+                  (points[:, 1] >= x0) & (points[:, 1] < x1))
+        widths[inside] = estimate_width(dist_win, points[inside, 0] - wy0, points[inside, 1] - wx0)
+        
+        node_img = np.full((y1 - y0 + 2, x1 - x0 + 2), -1, dtype=np.int64)
+        near = ((keypoints[:, 0] >= y0 - 1) & (keypoints[:, 0] <= y1) &
+                (keypoints[:, 1] >= x0 - 1) & (keypoints[:, 1] <= x1))
+        node_img[keypoints[near, 0] - y0 + 1, keypoints[near, 1] - x0 + 1] = node_ids[near]
+        body = skel[y0:y1, x0:x1] & (node_img[1:-1, 1:-1] < 0)
+        with profiling.timer('trace_edges'):
+            seg, n_seg = ndimage.label(body, structure=np.ones((3, 3), dtype=int))
+            sizes, width_sum, width_min, arc, contacts = _segment_stats(
+                seg, n_seg, node_img, 2 * dist_win[y0-wy0:y1-wy0, x0-wx0:x1-wx0])
+        
+        # Offset local labels to globally unique segment ids
+        seg = np.where(seg > 0, seg + n_total, 0)
+        contacts[:, 0] += n_total
+        seg_stats.append(np.stack([sizes[1:], width_sum[1:], width_min[1:], arc[1:]], axis=1))
+        seg_contacts.append(contacts)
+        n_total += n_seg
+        if y0 in row_seams: row_seams[y0][1][x0:x1] = seg[0]
+        if y1 in row_seams: row_seams[y1][0][x0:x1] = seg[-1]
+        if x0 in col_seams: col_seams[x0][1][y0:y1] = seg[:, 0]
+        if x1 in col_seams: col_seams[x1][0][y0:y1] = seg[:, -1]
     
+    # Union segments that touch (8-connectivity) across a seam, counting the
+    # arc of each seam-crossing link like skeleton_links does inside a tile
+    links, link_steps = [np.zeros((0, 2), dtype=np.int64)], [np.zeros(0)]
+    seams = [(b, a, ()) for b, a in row_seams.values()] + [(b, a, ybounds[1:-1]) for b, a in col_seams.values()]
+    for before, after, crossings in seams:
+        n = len(before)
+        for d in (-1, 0, 1):
+            k = np.arange(max(0, -d), n - max(0, d))
+            a, b = before[k], after[k + d]
+            hit = (a > 0) & (b > 0)
+            links.append(np.stack([a[hit], b[hit]], axis=1))
+            if d == 0:
+                link_steps.append(np.ones(hit.sum()))
+                continue
+            # m-adjacency: the diagonal (before[k], after[k + d]) has corners
+            # after[k] and before[k + d]. A diagonal through a tile corner lies
+            # on a row and a column seam; only the row seam counts it.
+            counted = (after[k] == 0) & (before[k + d] == 0) & ~np.isin(np.minimum(k, k + d) + 1, crossings)
+            link_steps.append(np.where(counted[hit], np.sqrt(2), 0.0))
+    links, link_steps = np.concatenate(links), np.concatenate(link_steps)
+    joined = sparse.coo_matrix((np.ones(len(links)), (links[:, 0], links[:, 1])),
+                               shape=(n_total + 1, n_total + 1))
+    _, root = connected_components(joined, directed=False)
+    
+    stats = np.concatenate(seg_stats).reshape(-1, 4)
+    groups = root[1:]
+    n_groups = root.max() + 1
+    sizes = np.bincount(groups, weights=stats[:, 0], minlength=n_groups)
+    width_sum = np.bincount(groups, weights=stats[:, 1], minlength=n_groups)
+    width_min = np.full(n_groups, np.inf)
+    np.minimum.at(width_min, groups, stats[:, 2])
+    arc = np.bincount(groups, weights=stats[:, 3], minlength=n_groups)
+    arc += np.bincount(root[links[:, 0]], weights=link_steps, minlength=n_groups)
+    contacts = np.concatenate(seg_contacts)
+    contacts[:, 0] = root[contacts[:, 0]]
+    contacts = np.unique(contacts, axis=0)
+    
+    with profiling.timer('trace_edges'):
+        edges = _join_segments(sizes, width_sum, width_min, arc, contacts)
+    return _graph_nodes(points, types, widths), with_tortuosity(points, [e for e in edges if e[2] > MIN_EDGE_LENGTH])
+
+def extract_file(mask_path, tracer='segments', native=False, memory_mb=DEFAULT_MEMORY_MB):
+    """Vessel graph of a mask file, downscaled to TARGET_SIZE or, with `native`,
+    at full resolution via extract_graph_tiled."""
+    if not native:
+        return extract_graph(load_mask(mask_path), tracer)
+    if tracer != 'segments':
+        raise ValueError("Native-resolution extraction only supports the 'segments' tracer")
+    return extract_graph_tiled(load_mask(mask_path, resize=False), memory_mb)
+
+def graph_rows(nodes, edges, graph_id):
+    """CSV rows (one per node, adjacency as ';'-joined ids) for an extracted graph.
+
+    The EDGE_ATTR_COLUMNS hold the attributes of each listed edge, ';'-joined
+    in the same order as `edges`.
+    """
     adj = {i: [] for i in range(len(nodes))}
-    for src, tgt, _ in edges:
-        adj[src].append(tgt)
-        adj[tgt].append(src)
+    for src, tgt, length, mean_width, min_width, tort in edges:
+        attrs = (str(length), f"{tort:.3f}", f"{mean_width:.2f}", f"{min_width:.2f}")
+        adj[src].append((str(tgt),) + attrs)
+        adj[tgt].append((str(src),) + attrs)
     
     rows = []
     for n in nodes:
-        rows.append({
+        row = {
             'graph_id': graph_id,
             'node_id': n['id'],
-            'x': round(n['x'], 1),
-            'y': round(n['y'], 1),
-            'width': round(n['width'], 1),
+            'x': float(np.round(n['x'], 1)),
+            'y': float(np.round(n['y'], 1)),
+            'width': float(np.round(n['width'], 1)),
             'type': n['type'],
-            'edges': ';'.join(map(str, adj[n['id']])) if adj[n['id']] else ''
-        })
+        }
+        for k, column in enumerate(('edges',) + EDGE_ATTR_COLUMNS):
+            row[column] = ';'.join(e[k] for e in adj[n['id']])
+        rows.append(row)
     return rows
 
+def mask_to_graph(mask_path, graph_id, tracer='segments', native=False, memory_mb=DEFAULT_MEMORY_MB):
+    nodes, edges = extract_file(mask_path, tracer, native, memory_mb)
+    return graph_rows(nodes, edges, graph_id)
+
+def mask_bytes_to_graph(data, graph_id, tracer='segments'):
+    """mask_to_graph for an encoded mask image held in memory."""
+    return graph_rows(*extract_graph(decode_mask(data), tracer), graph_id)
+
+def extraction_params(tracer='segments', native=False, memory_mb=DEFAULT_MEMORY_MB):
+    """Everything besides the mask itself that determines an extracted graph."""
+    if native:
+        return {
+            'version': CACHE_VERSION,
+            'native': True,
+            'memory_mb': memory_mb,
+            'tile_halo': TILE_HALO,
+            'merge_thresh': MERGE_THRESH,
+            'min_edge_length': MIN_EDGE_LENGTH,
+            'tracer': tracer,
+        }
+    return {
+        'version': CACHE_VERSION,
+        'target_size': TARGET_SIZE,
+        'merge_thresh': MERGE_THRESH,
+        'edge_radius': EDGE_RADIUS,
+        'max_trace_steps': MAX_TRACE_STEPS,
+        'min_edge_length': MIN_EDGE_LENGTH,
+        'tracer': tracer,
+    }
+
+def cache_key(mask_path, tracer='segments', native=False, memory_mb=DEFAULT_MEMORY_MB):
+    """Content address of a graph: hash of the mask file bytes and extraction params."""
+    h = hashlib.sha256()
+    with open(mask_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    h.update(json.dumps(extraction_params(tracer, native, memory_mb), sort_keys=True).encode())
+    return h.hexdigest()
+
+def cached_graph(mask_path, tracer='segments', cache_dir=None, native=False, memory_mb=DEFAULT_MEMORY_MB):
+    """extract_file result for a mask, served from `cache_dir` when present.
+
+    Returns (nodes, edges, hit). Entries are JSON files named by cache_key and
+    are written atomically, so concurrent workers never see partial files.
+    """
+    if cache_dir is None:
+        nodes, edges = extract_file(mask_path, tracer, native, memory_mb)
+        return nodes, edges, False
+    cache_dir = Path(cache_dir)
+    entry = cache_dir / f"{cache_key(mask_path, tracer, native, memory_mb)}.json"
+    if entry.exists():
+        cached = json.loads(entry.read_text())
+        return cached['nodes'], [tuple(e) for e in cached['edges']], True
+    nodes, edges = extract_file(mask_path, tracer, native, memory_mb)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp = entry.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps({'nodes': nodes, 'edges': edges}))
+    os.replace(tmp, entry)
+    return nodes, edges, False
+
+def prune_cache(cache_dir, keep):
+    """Delete cache entries whose key is not in `keep`; returns how many were removed."""
+    removed = 0
+    for entry in Path(cache_dir).glob('*.json'):
+        if entry.stem not in keep:
+            entry.unlink()
+            removed += 1
+    return removed
+
+def write_graph_store(rows, store_dir, labels=None):
+    """Write node rows (graph_rows format) as a binary, memory-mappable graph store.
+
+    Rows must be grouped by graph. Layout, with graphs in row order:
+      x.npy           float32 (N, 4)  raw node features x, y, width, type
+      node_ptr.npy    int64 (G + 1)   offset of each graph's first node
+      indptr.npy      int64 (N + 1)   CSR row pointer into the edge arrays
+      edge_index.npy  int64 (2, E)    graph-local (source, target) per edge;
+                                      row 1 is the CSR column-index array
+      edge_attr.npy   float32 (E, 4)  EDGE_ATTR_COLUMNS of each edge, only
+                                      written when the rows have them
+      graphs.csv                      graph_id and, if `labels` given, label
+    `labels` is a list of {'graph_id', 'label'} dicts.
+    """
+    df = pd.DataFrame(rows).reset_index(drop=True)
+    gids = pd.unique(df['graph_id'])
+    codes = pd.Categorical(df['graph_id'], categories=gids).codes.astype(np.int64)
+    if np.any(np.diff(codes) < 0):
+        raise ValueError("Rows must be grouped by graph_id")
+    node_ptr = np.searchsorted(codes, np.arange(len(gids) + 1))
+    
+    types = df['type'].map(lambda t: {'junction': 1, 'endpoint': 0}.get(t, t)).astype(float)
+    x = np.column_stack([df['x'], df['y'], df['width'], types]).astype(np.float32)
+    
+    # Adjacency strings -> (source row, target row), keeping per-node order
+    nbrs = df['edges'].fillna('').astype(str).str.split(';').explode().str.strip()
+    valid = nbrs.str.isdigit().to_numpy()
+    nbrs = nbrs[valid]
+    src = nbrs.index.to_numpy(dtype=np.int64)
+    nodes = pd.MultiIndex.from_arrays([codes, df['node_id'].astype(np.int64)])
+    dst = nodes.get_indexer(pd.MultiIndex.from_arrays([codes[src], nbrs.astype(np.int64).to_numpy()]))
+    edge_attr = None
+    if all(c in df.columns for c in EDGE_ATTR_COLUMNS):
+        edge_attr = np.column_stack([
+            pd.to_numeric(df[c].fillna('').astype(str).str.split(';').explode(), errors='coerce').to_numpy()[valid]
+            for c in EDGE_ATTR_COLUMNS])[dst >= 0].astype(np.float32)
+    src, dst = src[dst >= 0], dst[dst >= 0]
+    first = node_ptr[codes[src]]
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=len(df)))]).astype(np.int64)
+    
+    store = Path(store_dir)
+    store.mkdir(parents=True, exist_ok=True)
+    np.save(store / 'x.npy', x)
+    np.save(store / 'node_ptr.npy', node_ptr.astype(np.int64))
+    np.save(store / 'indptr.npy', indptr)
+    np.save(store / 'edge_index.npy', np.stack([src - first, dst - first]).astype(np.int64))
+    if edge_attr is not None:
+        np.save(store / 'edge_attr.npy', edge_attr)
+    elif (store / 'edge_attr.npy').exists():
+        (store / 'edge_attr.npy').unlink()
+    meta = pd.DataFrame({'graph_id': gids})
+    if labels is not None:
+        meta = meta.merge(pd.DataFrame(labels), on='graph_id', how='left')
+    meta.to_csv(store / 'graphs.csv', index=False)
+
+def csv_to_graph_store(csv_path, store_dir, label_path=None):
+    """Convert a node CSV (e.g. the published train_data.csv) to a graph store."""
+    rows = pd.read_csv(csv_path, dtype={c: str for c in ('edges',) + EDGE_ATTR_COLUMNS})
+    labels = pd.read_csv(label_path).to_dict('records') if label_path else None
+    write_graph_store(rows, store_dir, labels)
+
 def load_stare_diagnoses(path):
     """Load STARE diagnosis codes. Code 7 = Diabetic Retinopathy."""
     diagnoses = {}
@@ -136,15 +654,11 @@ def load_stare_diagnoses(path):
                 diagnoses[img_id] = 1 if has_dr else 0
     return diagnoses
 
-def main():
-    data_dir = Path(__file__).parent / 'data'
-    out_dir = data_dir / 'public'
-    
-    all_rows = []
-    all_labels = []
+def collect_jobs(data_dir):
+    """(graph_id, mask_path, label) for every raw mask, in dataset order."""
+    jobs = []
     
     # === DRIVE dataset (images 21-40) ===
-    print("Processing DRIVE dataset...")
     drive_masks = sorted((data_dir / 'raw' / 'drive').glob('*_manual1.gif'))
     
     drive_dr = {21:0, 22:0, 23:0, 24:0, 25:1, 26:1, 27:0, 28:0, 29:0, 30:0,
@@ -152,14 +666,9 @@ def main():
     
     for mask_path in drive_masks:
         img_num = int(mask_path.stem.split('_')[0])
-        gid = f"D_{img_num}"
-        print(f"  {gid}...")
-        rows = mask_to_graph(str(mask_path), gid)
-        all_rows.extend(rows)
-        all_labels.append({'graph_id': gid, 'label': drive_dr.get(img_num, 0)})
+        jobs.append((f"D_{img_num}", mask_path, drive_dr.get(img_num, 0)))
     
     # === STARE dataset ===
-    print("\nProcessing STARE dataset...")
     stare_dir = data_dir / 'raw' / 'stare'
     stare_diagnoses = load_stare_diagnoses(data_dir / 'hrf' / 'stare_codes.txt') if (data_dir / 'hrf' / 'stare_codes.txt').exists() else {}
     
@@ -172,38 +681,89 @@ def main():
         if not mask_path.exists():
             print(f"  Skipping S_{img_num} (no mask)")
             continue
-        gid = f"S_{img_num}"
-        print(f"  {gid}...")
-        rows = mask_to_graph(str(mask_path), gid)
-        all_rows.extend(rows)
-        label = stare_dr.get(img_num, 0)
-        all_labels.append({'graph_id': gid, 'label': label})
+        jobs.append((f"S_{img_num}", mask_path, stare_dr.get(img_num, 0)))
     
     # === HRF dataset ===
-    print("\nProcessing HRF dataset...")
     hrf_dir = data_dir / 'raw' / 'hrf'
     
     # Healthy images (01-15)
     for i in range(1, 16):
         mask_path = hrf_dir / f"{i:02d}_h.tif"
-        if not mask_path.exists():
-            continue
-        gid = f"H_{i}"
-        print(f"  {gid}...")
-        rows = mask_to_graph(str(mask_path), gid)
-        all_rows.extend(rows)
-        all_labels.append({'graph_id': gid, 'label': 0})
+        if mask_path.exists():
+            jobs.append((f"H_{i}", mask_path, 0))
     
-    # DR images (01-15)
+    # DR images (01-15), R for Retinopathy
     for i in range(1, 16):
         mask_path = hrf_dir / f"{i:02d}_dr.tif"
-        if not mask_path.exists():
-            continue
-        gid = f"R_{i}"  # R for Retinopathy
-        print(f"  {gid}...")
-        rows = mask_to_graph(str(mask_path), gid)
-        all_rows.extend(rows)
-        all_labels.append({'graph_id': gid, 'label': 1})
+        if mask_path.exists():
+            jobs.append((f"R_{i}", mask_path, 1))
+    
+    return jobs
+
+def _build_graph(job, tracer, cache_dir, native, memory_mb, profile=False):
+    gid, mask_path, _ = job
+    if profile:
+        profiling.enable()  # pool workers do not inherit the flag under spawn
+    start = time.perf_counter()
+    with profiling.scope('image', gid), profiling.timer('build_graph'):
+        nodes, edges, hit = cached_graph(mask_path, tracer, cache_dir, native, memory_mb)
+        rows = graph_rows(nodes, edges, gid)
+        profiling.count('cache_hits' if hit else 'cache_misses')
+        profiling.count('nodes', len(nodes))
+        profiling.count('edges', len(edges))
+    return rows, hit, time.perf_counter() - start, profiling.drain() if profile else None
+
+def build_graphs(jobs, tracer='segments', workers=1, cache_dir=None, native=False, memory_mb=DEFAULT_MEMORY_MB):
+    """Build the graph of every job and return their rows in job order.
+
+    With workers > 1 images are farmed out to a process pool; results are
+    still collected in job order, so the output matches a serial run exactly.
+    With a `cache_dir`, only masks without an up-to-date cache entry are
+    re-extracted. `native` and `memory_mb` are passed on to extract_file.
+    While profiling is enabled, per-image timings recorded in the workers are
+    merged into this process.
+    """
+    all_rows = []
+    start = time.perf_counter()
+    build = partial(_build_graph, tracer=tracer, cache_dir=cache_dir, native=native, memory_mb=memory_mb,
+                    profile=profiling.enabled())
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(build, jobs)
+    else:
+        pool = None
+        results = map(build, jobs)
+    try:
+        for k, (job, (rows, hit, elapsed, timings)) in enumerate(zip(jobs, results), 1):
+            profiling.merge(timings)
+            source = "cached" if hit else "built"
+            print(f"  [{k}/{len(jobs)}] {job[0]}: {len(rows)} nodes, {source} in {elapsed:.2f}s")
+            all_rows.extend(rows)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    print(f"Built {len(jobs)} graphs in {time.perf_counter() - start:.1f}s ({workers} worker(s))")
+    return all_rows
+
+def main(tracer='segments', workers=1, cache_dir=DEFAULT_CACHE_DIR, prune=False,
+         native=False, memory_mb=DEFAULT_MEMORY_MB, profile=None):
+    if profile:
+        profiling.enable()
+    data_dir = Path(__file__).parent / 'data'
+    out_dir = data_dir / 'public'
+    
+    jobs = collect_jobs(data_dir)
+    if prune:
+        if cache_dir is None:
+            raise ValueError("Pruning needs a cache directory")
+        keep = {cache_key(mask_path, tracer, native, memory_mb) for _, mask_path, _ in jobs}
+        removed = prune_cache(cache_dir, keep) if Path(cache_dir).exists() else 0
+        print(f"Pruned {removed} unreferenced cache entries from {cache_dir}")
+        return
+    
+    print("Processing DRIVE, STARE and HRF datasets...")
+    all_rows = build_graphs(jobs, tracer, workers, cache_dir, native, memory_mb)
+    all_labels = [{'graph_id': gid, 'label': label} for gid, _, label in jobs]
     
     # === Split into train/test ===
     print(f"\nTotal: {len(all_labels)} graphs")
@@ -230,17 +790,53 @@ def main():
     test_rows = [r for r in all_rows if r['graph_id'] in test_gids]
     
     # Save files
-    pd.DataFrame(train_rows).to_csv(out_dir / 'train_data.csv', index=False)
-    pd.DataFrame(train_labels).to_csv(out_dir / 'train_labels.csv', index=False)
-    pd.DataFrame(test_rows).to_csv(out_dir / 'test_data.csv', index=False)
-    pd.DataFrame(test_labels).to_csv(data_dir / 'private' / 'test_labels.csv', index=False)
-    pd.DataFrame([{'graph_id': l['graph_id'], 'label': 0} for l in test_labels]).to_csv(out_dir / 'sample_submission.csv', index=False)
+    with profiling.timer('write_outputs'):
+        pd.DataFrame(train_rows).to_csv(out_dir / 'train_data.csv', index=False)
+        pd.DataFrame(train_labels).to_csv(out_dir / 'train_labels.csv', index=False)
+        pd.DataFrame(test_rows).to_csv(out_dir / 'test_data.csv', index=False)
+        (data_dir / 'private').mkdir(exist_ok=True)
+        pd.DataFrame(test_labels).to_csv(data_dir / 'private' / 'test_labels.csv', index=False)
+        pd.DataFrame([{'graph_id': l['graph_id'], 'label': 0} for l in test_labels]).to_csv(out_dir / 'sample_submission.csv', index=False)
+        write_graph_store(train_rows, out_dir / 'train_graphs', train_labels)
+        write_graph_store(test_rows, out_dir / 'test_graphs')
     
     print(f"\n=== Summary ===")
     print(f"Train: {len(train_labels)} graphs, {len(train_rows)} nodes")
     print(f"Test:  {len(test_labels)} graphs, {len(test_rows)} nodes")
     print(f"Train DR: {sum(l['label'] for l in train_labels)}/{len(train_labels)}")
     print(f"Test DR:  {sum(l['label'] for l in test_labels)}/{len(test_labels)}")
+    if profile:
+        report = profiling.write_report(profile, tracer=tracer, workers=workers, native=native)
+        print(f"Profile written to {Path(profile).with_suffix('.json')} (peak RSS {report['meta']['peak_rss_mb']:.0f} MB)")
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    parser = argparse.ArgumentParser(description="Build GRAPE vessel graphs from the raw masks.")
+    parser.add_argument('--tracer', choices=TRACERS, default='segments',
+                        help="edge extractor: single-pass segment labelling or the legacy pairwise BFS")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes used to build graphs (default: 1, serial)")
+    parser.add_argument('--cache-dir', type=Path, default=DEFAULT_CACHE_DIR,
+                        help="directory of cached per-image graphs (default: data/cache/graphs)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="rebuild every graph without reading or writing the cache")
+    parser.add_argument('--prune-cache', action='store_true',
+                        help="delete cache entries not referenced by the current masks and settings, then exit")
+    parser.add_argument('--native', action='store_true',
+                        help="keep masks at full resolution and extract graphs tile by tile")
+    parser.add_argument('--memory-mb', type=int, default=DEFAULT_MEMORY_MB,
+                        help=f"working-memory budget per image in native mode (default: {DEFAULT_MEMORY_MB})")
+    parser.add_argument('--csv-to-store', nargs=2, metavar=('CSV', 'STORE_DIR'),
+                        help="convert an existing node CSV to a binary graph store, then exit")
+    parser.add_argument('--labels', help="label CSV to include with --csv-to-store")
+    parser.add_argument('--profile', type=Path, metavar='REPORT',
+                        help="time every extraction stage and write REPORT.json / REPORT.csv with per-image breakdowns")
+    args = parser.parse_args()
+    if args.prune_cache and args.no_cache:
+        parser.error("--prune-cache cannot be combined with --no-cache")
+    if args.csv_to_store:
+        csv_to_graph_store(*args.csv_to_store, label_path=args.labels)
+        raise SystemExit
+    main(tracer=args.tracer, workers=args.workers,
+         cache_dir=None if args.no_cache else args.cache_dir, prune=args.prune_cache,
+         native=args.native, memory_mb=args.memory_mb, profile=args.profile)
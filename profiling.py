@@ -0,0 +1,251 @@
+"""Lightweight timers and counters for preprocessing and training runs.
+
+Disabled by default. Then `timer()` hands back one shared no-op context
+manager and decorated functions cost a single flag check, so the
+instrumentation can stay in place permanently. Once enable() is called,
+every timer and counter is recorded in the run totals and in the
+innermost active scope (e.g. one image or one epoch), and each scope
+notes the process's peak RSS when it closes. write_report() saves a
+JSON report and a flat CSV of everything.
+
+    with profiling.scope('image', gid):
+        with profiling.timer('skeletonize'):
+            ...
+        profiling.count('nodes', len(nodes))
+"""
+import contextlib
+import csv
+import functools
+import json
+import math
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is reported as NaN
+    resource = None
+
+_enabled = False
+_started = None
+_timers = {}  # (scope kind, scope key, name) -> [calls, total seconds, max seconds]; totals use (None, None)
+_counters = {}  # (scope kind, scope key, name) -> value
+_peak_rss = {}  # (scope kind, scope key) -> MB
+_scopes = [(None, None)]
+_null = contextlib.nullcontext()
+
+
+def enable():
+    global _enabled, _started
+    _enabled = True
+    if _started is None:
+        _started = time.time()
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    global _started
+    _timers.clear()
+    _counters.clear()
+    _peak_rss.clear()
+    _started = time.time() if _enabled else None
+
+
+def _record(name, elapsed):
+    keys = [(None, None, name)]
+    if _scopes[-1][0] is not None:
+        keys.append(_scopes[-1] + (name,))
+    for key in keys:
+        entry = _timers.get(key)
+        if entry is None:
+            _timers[key] = [1, elapsed, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.name, time.perf_counter() - self.start)
+
+
+def timer(name):
+    """Context manager timing its block under `name`; a shared no-op when disabled."""
+    return _Timer(name) if _enabled else _null
+
+
+def timed(name=None):
+    """Decorator timing every call of a function, by default under its name."""
+    def decorate(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(label, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def timed_iter(iterable, name):
+    """Iterate over `iterable`, timing each step of the iterator (e.g. batch
+    collation of a DataLoader) under `name`."""
+    if not _enabled:
+        return iterable
+    return _timed_iter(iterable, name)
+
+
+def _timed_iter(iterable, name):
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        _record(name, time.perf_counter() - start)
+        yield item
+
+
+def count(name, n=1):
+    """Add `n` to counter `name` in the run totals and the current scope."""
+    if not _enabled:
+        return
+    keys = [(None, None, name)]
+    if _scopes[-1][0] is not None:
+        keys.append(_scopes[-1] + (name,))
+    for key in keys:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+@contextlib.contextmanager
+def scope(kind, key):
+    """Attribute timers and counters inside the block to (kind, key), e.g. ('epoch', 3)."""
+    if not _enabled:
+        yield
+        return
+    _scopes.append((kind, str(key)))
+    try:
+        yield
+    finally:
+        _peak_rss[_scopes.pop()] = peak_rss_mb()[0]
+
+
+def drain():
+    """Return and clear everything recorded so far, for merge() in another process."""
+    snapshot = {'timers': dict(_timers), 'counters': dict(_counters), 'peak_rss': dict(_peak_rss)}
+    _timers.clear()
+    _counters.clear()
+    _peak_rss.clear()
+    return snapshot
+
+
+def merge(snapshot):
+    """Fold a drain() snapshot, e.g. from a worker process, into this process."""
+    if not snapshot:
+        return
+    for key, (calls, total, longest) in snapshot['timers'].items():
+        entry = _timers.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += calls
+        entry[1] += total
+        entry[2] = max(entry[2], longest)
+    for key, value in snapshot['counters'].items():
+        _counters[key] = _counters.get(key, 0) + value
+    for key, value in snapshot['peak_rss'].items():
+        _peak_rss[key] = max(_peak_rss.get(key, 0), value)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished children, in MB
+    (NaN where the platform has no `resource` module)."""
+    if resource is None:
+        return math.nan, math.nan
+    scale = 1 / 2**20 if sys.platform == 'darwin' else 1 / 2**10  # ru_maxrss is bytes on macOS, KB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+def _timer_stats(calls, total, longest):
+    return {'calls': calls, 'total_s': round(total, 6), 'mean_ms': round(total / calls * 1000, 3),
+            'max_ms': round(longest * 1000, 3)}
+
+
+def report(**meta):
+    """The run so far as a JSON-serialisable dict; `meta` is stored as-is."""
+    self_rss, children_rss = peak_rss_mb()
+    out = {
+        'meta': {
+            'started_utc': datetime.fromtimestamp(_started or time.time(), timezone.utc).isoformat(timespec='seconds'),
+            'wall_s': round(time.time() - (_started or time.time()), 3),
+            'argv': sys.argv,
+            'pid': os.getpid(),
+            'peak_rss_mb': round(self_rss, 1),
+            'peak_rss_children_mb': round(children_rss, 1),
+            **meta,
+        },
+        'timers': {}, 'counters': {}, 'scopes': {},
+    }
+    for (kind, key, name), stats in _timers.items():
+        target = out if kind is None else out['scopes'].setdefault(kind, {}).setdefault(key, {'timers': {}, 'counters': {}})
+        target['timers'][name] = _timer_stats(*stats)
+    for (kind, key, name), value in _counters.items():
+        target = out if kind is None else out['scopes'].setdefault(kind, {}).setdefault(key, {'timers': {}, 'counters': {}})
+        target['counters'][name] = value
+    for (kind, key), value in _peak_rss.items():
+        out['scopes'].setdefault(kind, {}).setdefault(key, {'timers': {}, 'counters': {}})['peak_rss_mb'] = round(value, 1)
+    return out
+
+
+def write_report(path, **meta):
+    """Write report() to `path` (.json) and a flat table to the matching .csv.
+
+    CSV columns: scope, key, name, calls, total_s, mean_ms, max_ms, value;
+    run totals have scope 'run', counters and peak_rss_mb only fill `value`.
+    Returns the report dict.
+    """
+    data = report(**meta)
+    path = Path(path).with_suffix('.json')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, indent=2))
+
+    fields = ['scope', 'key', 'name', 'calls', 'total_s', 'mean_ms', 'max_ms', 'value']
+    rows = [{'scope': 'run', 'key': '', 'name': 'peak_rss_mb', 'value': data['meta']['peak_rss_mb']},
+            {'scope': 'run', 'key': '', 'name': 'peak_rss_children_mb', 'value': data['meta']['peak_rss_children_mb']}]
+    sections = [('run', '', data)] + [(kind, key, section) for kind, keyed in data['scopes'].items()
+                                   for key, section in keyed.items()]
+    for kind, key, section in sections:
+        rows += [{'scope': kind, 'key': key, 'name': name, **stats} for name, stats in section['timers'].items()]
+        rows += [{'scope': kind, 'key': key, 'name': name, 'value': value} for name, value in section['counters'].items()]
+        if 'peak_rss_mb' in section:
+            rows.append({'scope': kind, 'key': key, 'name': 'peak_rss_mb', 'value': section['peak_rss_mb']})
+    with open(path.with_suffix('.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    return data
@@ -0,0 +1,418 @@
+"""Long-lived inference service for GrapeGAT checkpoints.
+
+The checkpoint is loaded once and requests are answered over HTTP on a TCP
+port or a Unix socket:
+
+    POST /predict/mask    body: an encoded mask image (any format cv2 reads),
+                          optional ?id=<graph id>
+    POST /predict/graph   body: JSON {"graph_id": ..., "nodes": [...]}, nodes
+                          with the columns of train_data.csv
+    GET  /metrics         request latency percentiles, throughput, batching
+    GET  /health
+
+Masks become graphs in a process pool (preprocess.mask_bytes_to_graph) with
+the edge tracer recorded in the checkpoint, i.e. the one its training graphs
+were built with; checkpoints without one get 'bfs', the tracer of the
+published CSVs. Node widths are sampled at sub-pixel node positions, so
+they can differ slightly from those CSVs. Graphs of concurrent
+requests are grouped into micro-batches that close when the oldest request
+has waited `max_wait_ms` or the batch reaches `max_graphs` / `max_nodes`,
+and each micro-batch is scored in one forward pass.
+"""
+import http.client
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+from torch_geometric.data import Batch
+
+from baseline import DATA_TRACER, EDGE_ATTR_COLUMNS, TRACERS, graphs_from_frame, load_checkpoint
+from preprocess import mask_bytes_to_graph
+
+MAX_BODY_BYTES = 64 * 2**20
+LATENCY_WINDOW = 2048  # most recent requests kept for latency percentiles
+_STOP = object()  # queued by MicroBatcher.close() to end the batching thread
+
+
+class BadRequest(Exception):
+    """A request the service cannot score; answered with HTTP 400."""
+
+
+class MicroBatcher:
+    """Scores graphs submitted from many threads in shared forward passes."""
+    def __init__(self, model, max_graphs=32, max_nodes=20000, max_wait_ms=10.0):
+        self.model = model.eval()
+        self.max_graphs, self.max_nodes = max_graphs, max_nodes
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.batch_sizes = deque(maxlen=LATENCY_WINDOW)
+        self.forward_ms = deque(maxlen=LATENCY_WINDOW)
+        self._carry = []  # at most one item that did not fit the previous batch
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, data):
+        """Future of (probabilities, timings) for one graph."""
+        future = Future()
+        self.queue.put((data, future, time.perf_counter()))
+        return future
+
+    def close(self):
+        self.queue.put(_STOP)
+        self._thread.join()
+
+    def _collect(self):
+        first = self._carry.pop() if self._carry else self.queue.get()
+        if first is _STOP:
+            return None
+        items, nodes = [first], first[0].num_nodes
+        deadline = first[2] + self.max_wait
+        while len(items) < self.max_graphs:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            if item is _STOP or nodes + item[0].num_nodes > self.max_nodes:
+                self._carry.append(item)  # opens the next batch (or stops the loop)
+                break
+            items.append(item)
+            nodes += item[0].num_nodes
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            if items is None:
+                return
+            start = time.perf_counter()
+            try:
+                with torch.inference_mode():
+                    probs = F.softmax(self.model(Batch.from_data_list([d for d, _, _ in items])), dim=1)
+            except Exception as e:
+                for _, future, _ in items:
+                    future.set_exception(e)
+                continue
+            forward_ms = (time.perf_counter() - start) * 1000
+            self.batch_sizes.append(len(items))
+            self.forward_ms.append(forward_ms)
+            for (_, future, queued), p in zip(items, probs.tolist()):
+                future.set_result((p, {'queue_ms': (start - queued) * 1000, 'forward_ms': forward_ms,
+                                       'batch_size': len(items)}))
+
+
+class Metrics:
+    """Thread-safe request counters and a rolling window of latencies."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests, self.errors = {}, {}
+        self.latencies = {}  # endpoint -> deque of (finish time, ms)
+
+    def record(self, endpoint, latency_ms, ok=True):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            self.latencies.setdefault(endpoint, deque(maxlen=LATENCY_WINDOW)).append((time.time(), latency_ms))
+
+    def snapshot(self, window_s=60):
+        now = time.time()
+        with self.lock:
+            endpoints = {}
+            for endpoint, recent in self.latencies.items():
+                ms = np.array([m for _, m in recent])
+                endpoints[endpoint] = {
+                    'requests': self.requests[endpoint],
+                    'errors': self.errors.get(endpoint, 0),
+                    'recent_rps': sum(t >= now - window_s for t, _ in recent) / max(min(window_s, now - self.started), 1e-9),
+                    **{f'p{q}_ms': float(np.percentile(ms, q)) for q in (50, 95, 99)},
+                }
+            total = sum(self.requests.values())
+        return {'uptime_s': now - self.started, 'requests': total,
+                'throughput_rps': total / max(now - self.started, 1e-9), 'endpoints': endpoints}
+
+
+class InferenceService:
+    """Warm model, extraction pool and micro-batcher behind the HTTP handlers."""
+    def __init__(self, checkpoint, workers=2, max_graphs=32, max_nodes=20000, max_wait_ms=10.0, tracer=None):
+        self.model, ckpt = load_checkpoint(checkpoint)
+        self.checkpoint = str(checkpoint)
+        self.edge_dim = self.model.config['edge_dim']
+        self.tracer = tracer or ckpt.get('extraction', {}).get('tracer', DATA_TRACER)
+        if self.tracer not in TRACERS:
+            raise ValueError(f"Unknown tracer: {self.tracer}")
+        self.batcher = MicroBatcher(self.model, max_graphs, max_nodes, max_wait_ms)
+        self.metrics = Metrics()
+        self.extract_ms = deque(maxlen=LATENCY_WINDOW)
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        # Start every worker now so the first requests do not pay for interpreter start-up
+        for f in [self.pool.submit(os.getpid) for _ in range(workers)]:
+            f.result()
+
+    def close(self):
+        self.batcher.close()
+        self.pool.shutdown()
+
+    def _score(self, data, timings):
+        if self.edge_dim and data.edge_attr is None:
+            raise BadRequest(f"This model attends over edge attributes; graphs need the columns {', '.join(EDGE_ATTR_COLUMNS)}")
+        if not self.edge_dim:
+            data.edge_attr = None  # batches may mix graphs with and without them
+        probs, batch_timings = self.batcher.submit(data).result()
+        return {'graph_id': data.gid, 'label': int(np.argmax(probs)), 'probability': probs[1],
+                'nodes': data.num_nodes, 'edges': data.num_edges, 'timings_ms': {**timings, **batch_timings}}
+
+    @staticmethod
+    def _node_frame(rows):
+        """DataFrame of request nodes, checked so that graphs_from_frame only sees well-formed values."""
+        if not rows:
+            raise BadRequest("Graph has no nodes")
+        df = pd.DataFrame(rows)
+        for column in ('edges',) + EDGE_ATTR_COLUMNS:
+            if column in df.columns:
+                df[column] = [';'.join(map(str, v)) if isinstance(v, (list, tuple)) else v for v in df[column]]
+        missing = {'graph_id', 'node_id', 'x', 'y', 'width', 'edges'} - set(df.columns)
+        if missing:
+            raise BadRequest(f"Nodes are missing columns: {', '.join(sorted(missing))}")
+        df['graph_id'] = df['graph_id'].astype(str)
+        if df['graph_id'].nunique() != 1:
+            raise BadRequest("Expected the nodes of exactly one graph")
+        if 'type' in df.columns:
+            df['type'] = df['type'].replace({'junction': 1, 'endpoint': 0})
+        for column in ('node_id', 'x', 'y', 'width') + (('type',) if 'type' in df.columns else ()):
+            try:
+                df[column] = pd.to_numeric(df[column])
+            except (ValueError, TypeError):
+                raise BadRequest(f"Column {column} must be numeric") from None
+            if df[column].isna().any():
+                raise BadRequest(f"Column {column} must be numeric")
+        if (df['node_id'] % 1 != 0).any() or df['node_id'].duplicated().any():
+            raise BadRequest("Column node_id must hold distinct integers")
+        df['edges'] = df['edges'].fillna('').astype(str)
+        if all(c in df.columns for c in EDGE_ATTR_COLUMNS):
+            counts = [len(s.split(';')) if s else 0 for s in df['edges']]
+            for column in EDGE_ATTR_COLUMNS:
+                df[column] = df[column].fillna('').astype(str)
+                for value, n in zip(df[column], counts):
+                    try:
+                        values = [float(v) for v in value.split(';')] if value else []
+                    except ValueError:
+                        raise BadRequest(f"Column {column} must hold ';'-separated numbers") from None
+                    if len(values) != n:
+                        raise BadRequest(f"Column {column} needs one value per entry of edges")
+        return df
+
+    def predict_rows(self, rows, timings=None):
+        graph, = graphs_from_frame(self._node_frame(rows))
+        return self._score(graph, timings or {})
+
+    def predict_mask(self, data, graph_id):
+        start = time.perf_counter()
+        if not data:
+            raise BadRequest("Empty mask image")
+        try:
+            rows = self.pool.submit(mask_bytes_to_graph, data, graph_id, self.tracer).result()
+        except ValueError as e:  # the only one extraction raises: an image cv2 cannot decode
+            raise BadRequest(str(e)) from None
+        extract_ms = (time.perf_counter() - start) * 1000
+        self.extract_ms.append(extract_ms)
+        return self.predict_rows(rows, {'extract_ms': extract_ms})
+
+    def predict_graph(self, payload):
+        nodes = payload.get('nodes', []) if isinstance(payload, dict) else None
+        if not isinstance(nodes, list) or not all(isinstance(node, dict) for node in nodes):
+            raise BadRequest('Expected a JSON object {"graph_id": ..., "nodes": [{...}, ...]}')
+        graph_id = payload.get('graph_id', 'graph')
+        return self.predict_rows([{'graph_id': graph_id, **node} for node in nodes])
+
+    def stats(self):
+        out = self.metrics.snapshot()
+        sizes, forward = list(self.batcher.batch_sizes), list(self.batcher.forward_ms)
+        out.update({
+            'checkpoint': self.checkpoint,
+            'tracer': self.tracer,
+            'queue_depth': self.batcher.queue.qsize(),
+            'batches': len(sizes),
+            'mean_batch_size': float(np.mean(sizes)) if sizes else 0.0,
+            'forward_p50_ms': float(np.percentile(forward, 50)) if forward else 0.0,
+            'extract_p50_ms': float(np.percentile(self.extract_ms, 50)) if self.extract_ms else 0.0,
+        })
+        return out
+
+
+class Handler(BaseHTTPRequestHandler):
+    service = None  # set by make_server
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        pass  # /metrics replaces the per-request access log
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send(200, {'status': 'ok'})
+        elif path == '/metrics':
+            self._send(200, self.service.stats())
+        else:
+            self._send(404, {'error': f"Unknown path {path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path not in ('/predict/mask', '/predict/graph'):
+            self._send(404, {'error': f"Unknown path {url.path}"})
+            return
+        start = time.perf_counter()
+        status = 200
+        try:
+            length = self.headers.get('Content-Length', '0')
+            if not length.isdigit():
+                raise BadRequest("Missing or invalid Content-Length")
+            length = int(length)
+            if length > MAX_BODY_BYTES:
+                status, body = 413, {'error': f"Request body exceeds {MAX_BODY_BYTES} bytes"}
+                self.close_connection = True
+            else:
+                data = self.rfile.read(length)
+                if url.path == '/predict/mask':
+                    graph_id = parse_qs(url.query).get('id', ['mask'])[0]
+                    body = self.service.predict_mask(data, graph_id)
+                else:
+                    try:
+                        payload = json.loads(data)
+                    except ValueError as e:
+                        raise BadRequest(f"Invalid JSON: {e}") from None
+                    body = self.service.predict_graph(payload)
+        except BadRequest as e:
+            status, body = 400, {'error': str(e)}
+        except Exception as e:
+            traceback.print_exc()
+            status, body = 500, {'error': f"{type(e).__name__}: {e}"}
+        latency_ms = (time.perf_counter() - start) * 1000
+        if status == 200:
+            body['timings_ms']['total_ms'] = latency_ms
+        self.service.metrics.record(url.path, latency_ms, ok=status == 200)
+        self._send(status, body)
+
+
+class TCPHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128  # listen backlog; the default of 5 refuses bursts of concurrent clients
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_server(service, host='127.0.0.1', port=8000, socket_path=None):
+    """HTTP server for `service` on host:port, or on a Unix socket if `socket_path` is given."""
+    handler = type('ServiceHandler', (Handler,), {'service': service})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        return UnixHTTPServer(socket_path, handler)
+    return TCPHTTPServer((host, port), handler)
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class Client:
+    """Small blocking client; `address` is a (host, port) pair or a Unix socket path."""
+    def __init__(self, address, timeout=60):
+        self.address, self.timeout = address, timeout
+
+    def _request(self, method, path, body=None, content_type='application/octet-stream'):
+        if isinstance(self.address, (str, os.PathLike)):
+            conn = _UnixConnection(str(self.address), self.timeout)
+        else:
+            conn = http.client.HTTPConnection(*self.address, timeout=self.timeout)
+        try:
+            conn.request(method, path, body, {'Content-Type': content_type} if body is not None else {})
+            response = conn.getresponse()
+            result = json.loads(response.read())
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise RuntimeError(f"{method} {path} failed ({response.status}): {result.get('error')}")
+        return result
+
+    def predict_mask(self, mask, graph_id='mask'):
+        """Prediction for a mask image, given as a file path or encoded bytes."""
+        if isinstance(mask, bytes):
+            data = mask
+        else:
+            with open(mask, 'rb') as f:
+                data = f.read()
+        return self._request('POST', '/predict/mask?' + urlencode({'id': graph_id}), data)
+
+    def predict_graph(self, graph_id, nodes):
+        """Prediction for a graph given as a list of node dicts (train_data.csv columns)."""
+        payload = json.dumps({'graph_id': graph_id, 'nodes': nodes}, default=float)
+        return self._request('POST', '/predict/graph', payload.encode(), 'application/json')
+
+    def metrics(self):
+        return self._request('GET', '/metrics')
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve GrapeGAT predictions for vessel masks and graphs.")
+    parser.add_argument('checkpoint', help="checkpoint written by baseline.save_checkpoint / cv.py")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--socket', help="listen on this Unix socket instead of host:port")
+    parser.add_argument('--workers', type=int, default=2, help="mask extraction processes (default: 2)")
+    parser.add_argument('--threads', type=int, help="torch intra-op threads for the forward pass")
+    parser.add_argument('--max-graphs', type=int, default=32, help="graphs per micro-batch (default: 32)")
+    parser.add_argument('--max-nodes', type=int, default=20000, help="nodes per micro-batch (default: 20000)")
+    parser.add_argument('--max-wait-ms', type=float, default=10.0,
+                        help="longest a request waits for a micro-batch to fill (default: 10)")
+    parser.add_argument('--tracer', choices=TRACERS,
+                        help=f"edge tracer for uploaded masks (default: the checkpoint's, else {DATA_TRACER})")
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    service = InferenceService(args.checkpoint, args.workers, args.max_graphs, args.max_nodes, args.max_wait_ms,
+                               args.tracer)
+    server = make_server(service, args.host, args.port, args.socket)
+    print(f"Serving {args.checkpoint} ({service.tracer} tracer) on {args.socket or f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,225 @@
+"""Hyperparameter sweep of the GAT baseline with asynchronous successive halving.
+
+Trials sample a configuration from a search space and train on a process
+pool in rung-sized segments: min_epochs, min_epochs * eta, ... up to
+max_epochs. When a worker frees up, the scheduler promotes a paused trial
+that ranks in the top 1/eta of its rung (ASHA), otherwise it starts a new
+trial. Bad configurations therefore stop after a few epochs.
+
+Every finished segment is appended to a JSON-lines trial log and the
+trial's training state is saved next to it, so an interrupted sweep picks
+up where it stopped when run again with the same out_dir.
+"""
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from baseline import DATA_TRACER, TRACERS, GrapeDataset, fit
+from cv import fold_splits, init_worker
+
+DEFAULT_OUT_DIR = Path('checkpoints/sweep')
+
+# name -> list of choices, or {'low', 'high', 'log'} range
+DEFAULT_SPACE = {
+    'hid': [32, 64, 128],
+    'heads': [2, 4, 8],
+    'dropout': [0.1, 0.3, 0.5],
+    'lr': {'low': 1e-4, 'high': 2e-2, 'log': True},
+    'weight_decay': {'low': 1e-6, 'high': 1e-3, 'log': True},
+    'patience': [10, 30, 60],
+    'augment': [False, True],
+}
+
+_graphs = None  # dataset loaded once per worker
+_split = None
+
+
+def sample_params(space, rng):
+    params = {}
+    for name, spec in space.items():
+        if isinstance(spec, dict):
+            low, high = spec['low'], spec['high']
+            if spec.get('log'):
+                params[name] = math.exp(rng.uniform(math.log(low), math.log(high)))
+            else:
+                params[name] = rng.uniform(low, high)
+        else:
+            params[name] = rng.choice(spec)
+    return params
+
+
+def rung_epochs(min_epochs, max_epochs, eta):
+    """Epoch budget of each rung: min_epochs * eta**k, capped by max_epochs."""
+    rungs = [min_epochs]
+    while rungs[-1] < max_epochs:
+        rungs.append(min(rungs[-1] * eta, max_epochs))
+    return rungs
+
+
+def read_log(log_path):
+    """(config, records) of a trial log, or (None, []) if there is none."""
+    if not Path(log_path).exists():
+        return None, []
+    with open(log_path) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    return lines[0]['config'], lines[1:]
+
+
+def _init_worker(graph_path, label_path, seed, threads):
+    global _graphs, _split
+    _graphs = init_worker(graph_path, label_path, threads)
+    _, _, train_idx, val_idx = fold_splits(np.array([int(g.y) for g in _graphs]), 5, [seed])[0]
+    _split = train_idx, val_idx
+
+
+def _run_segment(trial, params, epochs, state_path, seed, tracer):
+    start = time.perf_counter()
+    state = torch.load(state_path, weights_only=True) if Path(state_path).exists() else {}
+    _, val_acc = fit(_graphs, *_split, seed=seed + trial, epochs=epochs, verbose=False, state=state, **params)
+    state['extraction'] = {'tracer': tracer}
+    tmp = Path(state_path).with_suffix('.tmp')
+    torch.save(state, tmp)
+    os.replace(tmp, state_path)
+    return {'trial': trial, 'params': params, 'epochs': epochs, 'trained_epochs': state['epoch'],
+            'metric': val_acc, 'stopped': state['stopped'], 'seconds': time.perf_counter() - start}
+
+
+class ASHA:
+    """Promotion bookkeeping of asynchronous successive halving."""
+    def __init__(self, rungs, eta):
+        self.rungs, self.eta = rungs, eta
+        self.results = [{} for _ in rungs]  # rung -> trial -> metric
+        self.stopped = set()
+
+    def record(self, rung, trial, metric, stopped):
+        self.results[rung][trial] = metric
+        if stopped:
+            self.stopped.add(trial)
+
+    def promotable(self, busy):
+        """(trial, next rung) to continue, or None. Highest rungs first."""
+        for rung in range(len(self.rungs) - 2, -1, -1):
+            results = self.results[rung]
+            top = sorted(results, key=lambda t: (-results[t], t))[:len(results) // self.eta]
+            for trial in top:
+                if trial not in self.results[rung + 1] and trial not in busy and trial not in self.stopped:
+                    return trial, rung + 1
+        return None
+
+    def best(self):
+        """(trial, rung) of the best result at the highest rung reached."""
+        for rung in range(len(self.rungs) - 1, -1, -1):
+            results = self.results[rung]
+            if results:
+                return max(results, key=lambda t: (results[t], -t)), rung
+        return None
+
+
+def sweep(graph_path='data/public/train_data.csv', label_path='data/public/train_labels.csv',
+          space=None, trials=27, min_epochs=10, max_epochs=270, eta=3, workers=None, threads=None,
+          seed=0, out_dir=DEFAULT_OUT_DIR, tracer=DATA_TRACER):
+    """Run (or resume) a sweep. Returns the best trial's log record."""
+    space = space or DEFAULT_SPACE
+    out_dir = Path(out_dir)
+    (out_dir / 'states').mkdir(parents=True, exist_ok=True)
+    log_path = out_dir / 'trials.jsonl'
+    config = {'graphs': str(graph_path), 'labels': str(label_path), 'space': space,
+              'min_epochs': min_epochs, 'max_epochs': max_epochs, 'eta': eta, 'seed': seed, 'tracer': tracer}
+    logged_config, records = read_log(log_path)
+    if logged_config is None:
+        with open(log_path, 'w') as f:
+            f.write(json.dumps({'config': config}) + '\n')
+    elif {'tracer': DATA_TRACER, **logged_config} != json.loads(json.dumps(config)):  # older logs lack the tracer
+        raise ValueError(f"{log_path} was written by a sweep with different settings")
+
+    rungs = rung_epochs(min_epochs, max_epochs, eta)
+    asha = ASHA(rungs, eta)
+    params = {}
+    for rec in records:
+        params[rec['trial']] = rec['params']
+        asha.record(rungs.index(rec['epochs']), rec['trial'], rec['metric'], rec['stopped'])
+    if records:
+        print(f"Resuming sweep: {len(records)} segments of {len(params)} trials already logged")
+
+    GrapeDataset(graph_path, label_path)  # builds the processed cache once so the spawned workers only read it
+    cores = os.cpu_count() or 1
+    workers = workers or min(trials, cores)
+    threads = threads or max(1, cores // workers)
+    next_trial = 0
+    running = {}  # future -> trial
+    start = time.perf_counter()
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(str(graph_path), str(label_path), seed, threads)) as pool, \
+            open(log_path, 'a') as log:
+        while True:
+            while len(running) < workers:
+                job = asha.promotable(set(running.values()))
+                if job is None:
+                    while next_trial in params:
+                        next_trial += 1
+                    if next_trial >= trials:
+                        break
+                    trial, rung = next_trial, 0
+                    # Seeded by trial id so a resumed sweep samples the same configurations
+                    params[trial] = sample_params(space, random.Random(f"{seed}-{trial}"))
+                else:
+                    trial, rung = job
+                state_path = out_dir / 'states' / f"trial-{trial}.pt"
+                if rung == 0 and state_path.exists():
+                    state_path.unlink()  # left over from a segment that never got logged
+                future = pool.submit(_run_segment, trial, params[trial], rungs[rung], state_path, seed, tracer)
+                running[future] = trial
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                rec = future.result()
+                asha.record(rungs.index(rec['epochs']), rec['trial'], rec['metric'], rec['stopped'])
+                log.write(json.dumps(rec) + '\n')
+                log.flush()
+                print(f"  trial {rec['trial']} @ {rec['epochs']} epochs: val_acc={rec['metric']:.3f}"
+                      f"{' (early stopped)' if rec['stopped'] else ''} ({rec['seconds']:.1f}s)")
+
+    _, records = read_log(log_path)
+    trained = sum(r['trained_epochs'] for r in {r['trial']: r for r in records}.values())
+    trial, rung = asha.best()
+    best = [r for r in records if r['trial'] == trial and r['epochs'] == rungs[rung]][-1]
+    print(f"{len(params)} trials, {trained} epochs trained (full runs would take {len(params) * max_epochs}) "
+          f"in {time.perf_counter() - start:.1f}s")
+    print(f"Best: trial {trial}, val_acc={best['metric']:.3f} after {best['epochs']} epochs, params={best['params']}")
+    return best
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="ASHA hyperparameter sweep of the GAT baseline.")
+    parser.add_argument('--graphs', default='data/public/train_data.csv',
+                        help="graph CSV or graph store directory (default: data/public/train_data.csv)")
+    parser.add_argument('--labels', default='data/public/train_labels.csv')
+    parser.add_argument('--space', type=Path,
+                        help="JSON search space: name -> list of choices or {low, high, log} (default: built-in)")
+    parser.add_argument('--trials', type=int, default=27)
+    parser.add_argument('--min-epochs', type=int, default=10, help="budget of the lowest rung (default: 10)")
+    parser.add_argument('--max-epochs', type=int, default=270, help="budget of the top rung (default: 270)")
+    parser.add_argument('--eta', type=int, default=3, help="halving rate (default: 3)")
+    parser.add_argument('--workers', type=int, help="number of trials trained at once (default: one per core)")
+    parser.add_argument('--threads', type=int, help="torch intra-op threads per worker (default: cores / workers)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tracer', choices=TRACERS, default=DATA_TRACER,
+                        help="preprocess.py tracer the graphs were built with, recorded in the trial states (default: %(default)s)")
+    parser.add_argument('--out-dir', type=Path, default=DEFAULT_OUT_DIR,
+                        help="trial log and states; rerun with the same directory to resume (default: checkpoints/sweep)")
+    args = parser.parse_args()
+    space = json.loads(args.space.read_text()) if args.space else None
+    sweep(args.graphs, args.labels, space, args.trials, args.min_epochs, args.max_epochs, args.eta,
+          args.workers, args.threads, args.seed, args.out_dir, args.tracer)
@@ -0,0 +1,60 @@
+"""find_keypoints against the original per-pixel loop it replaced."""
+from pathlib import Path
+
+import numpy as np
+import pytest
+from skimage.morphology import skeletonize
+
+from preprocess import collect_jobs, find_keypoints, load_mask
+
+DATA_DIR = Path(__file__).resolve().parents[1] / 'data'
+
+
+def get_neighbors(skel, y, x):
+    h, w = skel.shape
+    count = 0
+    for dy in [-1, 0, 1]:
+        for dx in [-1, 0, 1]:
+            if dy == 0 and dx == 0: continue
+            ny, nx = y + dy, x + dx
+            if 0 <= ny < h and 0 <= nx < w and skel[ny, nx]:
+                count += 1
+    return count
+
+def legacy_find_keypoints(skel):
+    h, w = skel.shape
+    endpoints, junctions = [], []
+    for y in range(1, h-1):
+        for x in range(1, w-1):
+            if not skel[y, x]: continue
+            n = get_neighbors(skel, y, x)
+            if n == 1: endpoints.append((y, x))
+            elif n >= 3: junctions.append((y, x))
+    return endpoints, junctions
+
+
+def assert_same_keypoints(skel):
+    endpoints, junctions = find_keypoints(skel)
+    legacy_endpoints, legacy_junctions = legacy_find_keypoints(skel)
+    np.testing.assert_array_equal(endpoints, np.array(legacy_endpoints, dtype=np.int64).reshape(-1, 2))
+    np.testing.assert_array_equal(junctions, np.array(legacy_junctions, dtype=np.int64).reshape(-1, 2))
+
+
+JOBS = collect_jobs(DATA_DIR) if (DATA_DIR / 'raw').exists() else []
+
+@pytest.mark.skipif(not JOBS, reason="raw masks not available in data/raw")
+@pytest.mark.parametrize('graph_id,mask_path', [(gid, path) for gid, path, _ in JOBS], ids=[gid for gid, _, _ in JOBS])
+def test_raw_masks_match_legacy(graph_id, mask_path):
+    skel = skeletonize(load_mask(mask_path) > 0).astype(np.uint8)
+    assert_same_keypoints(skel)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_skeletons_match_legacy(seed):
+    # Dense noise reaches the image border, where neighbours are cut off
+    rng = np.random.default_rng(seed)
+    skel = skeletonize(rng.random((64, 48)) < 0.35).astype(np.uint8)
+    assert_same_keypoints(skel)
+
+def test_empty_skeleton():
+    endpoints, junctions = find_keypoints(np.zeros((10, 10), dtype=np.uint8))
+    assert endpoints.shape == (0, 2) and junctions.shape == (0, 2)
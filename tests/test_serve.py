@@ -0,0 +1,84 @@
+"""serve.py end to end: a server on an ephemeral port, driven through serve.Client."""
+import http.client
+import threading
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+from baseline import GrapeGAT, save_checkpoint
+from preprocess import mask_bytes_to_graph
+from serve import Client, InferenceService, make_server
+
+
+def vessel_mask():
+    """A small branching vessel tree, encoded as PNG."""
+    mask = np.zeros((120, 120), dtype=np.uint8)
+    cv2.line(mask, (10, 60), (60, 60), 255, 3)
+    cv2.line(mask, (60, 60), (110, 20), 255, 3)
+    cv2.line(mask, (60, 60), (110, 100), 255, 3)
+    cv2.line(mask, (85, 40), (85, 5), 255, 2)
+    return cv2.imencode('.png', mask)[1].tobytes()
+
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory):
+    torch.manual_seed(0)
+    checkpoint = tmp_path_factory.mktemp('serve') / 'model.pt'
+    save_checkpoint(GrapeGAT(in_dim=4, hid=8, heads=2), checkpoint)
+    service = InferenceService(checkpoint, workers=1, max_wait_ms=1.0)
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+
+def post(server, path, body):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=60)
+    try:
+        conn.request('POST', path, body, {'Content-Type': 'application/json'})
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+
+def test_predict_graph(server):
+    rows = [{k: v for k, v in row.items() if k != 'graph_id'} for row in mask_bytes_to_graph(vessel_mask(), 'tree')]
+    result = Client(server.server_address).predict_graph('tree', rows)
+    assert result['graph_id'] == 'tree'
+    assert result['nodes'] == len(rows) and result['edges'] > 0
+    assert result['label'] in (0, 1) and 0 <= result['probability'] <= 1
+
+
+def test_predict_mask(server):
+    result = Client(server.server_address).predict_mask(vessel_mask(), graph_id='tree & co')
+    assert result['graph_id'] == 'tree & co'
+    assert result['nodes'] > 0 and 'extract_ms' in result['timings_ms']
+
+
+def test_predict_mask_from_file(server, tmp_path):
+    path = tmp_path / 'mask.png'
+    path.write_bytes(vessel_mask())
+    assert Client(server.server_address).predict_mask(path)['graph_id'] == 'mask'
+
+
+@pytest.mark.parametrize('path,body', [
+    ('/predict/graph', b'{"nodes": [1, 2'),
+    ('/predict/graph', b'[1, 2]'),
+    ('/predict/graph', b'{"nodes": []}'),
+    ('/predict/graph', b'{"nodes": [{"node_id": 0, "x": "left", "y": 1, "width": 2, "edges": ""}]}'),
+    ('/predict/mask', b'not an image'),
+])
+def test_malformed_body_is_a_bad_request(server, path, body):
+    assert post(server, path, body) == 400
+
+
+def test_metrics_count_requests(server):
+    client = Client(server.server_address)
+    client.predict_mask(vessel_mask())
+    metrics = client.metrics()
+    assert metrics['requests'] > 0 and metrics['tracer'] == 'bfs'